@@ -0,0 +1,52 @@
+"""
+Microbenchmark of the timest codec against the per-row conversion it replaced in update_sensor.
+
+Usage:
+    python benchmarks/bench_codec.py [rows]
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tethysapp', 'open_air'))
+from conversion_helpers import timest2datetime64, datetime642timest  # noqa: E402
+
+
+def legacy_str2datetime(time_string):
+    """
+    The original per-row parser, kept here as the baseline.
+    """
+    return datetime(year=int(time_string[0:4]), month=int(time_string[4:6]), day=int(time_string[6:8]),
+                    hour=int(time_string[8:10]), minute=int(time_string[10:12]), second=int(time_string[12:14]))
+
+
+def synthetic_timest(rows):
+    start = np.datetime64('2018-01-01T00:00:00')
+    return datetime642timest(start + np.arange(rows) * np.timedelta64(15, 'm'))
+
+
+def best_of(statement, repeat=5):
+    return min(timeit.repeat(statement, number=1, repeat=repeat))
+
+
+def main(rows=30 * 96 * 4):
+    timest = synthetic_timest(rows)
+    decimals = [Decimal(int(value)) for value in timest]
+
+    per_row = best_of(lambda: [legacy_str2datetime(str(value)) for value in decimals])
+    batch = best_of(lambda: timest2datetime64(timest))
+    inverse = best_of(lambda: datetime642timest(timest2datetime64(timest)))
+
+    print('rows: {0}'.format(rows))
+    for label, seconds in (('per-row str2datetime', per_row), ('batch timest2datetime64', batch),
+                           ('batch round trip', inverse)):
+        print('{0:<24} {1:10.3f} ms {2:8.3f} us/row'.format(label, seconds * 1e3, seconds / rows * 1e6))
+    print('speedup: {0:.0f}x'.format(per_row / batch))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,19 +1,172 @@
-# Define your REST API endpoints here.
-# In the comments below is an example.
-# For more information, see:
-# http://docs.tethysplatform.org/en/dev/tethys_sdk/rest_api.html
-"""
-from django.http import JsonResponse
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.decorators import api_view, authentication_classes
+import json
+from datetime import datetime
+
+import numpy as np
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.gzip import gzip_page
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+
+from .db import get_session, get_session_maker, pool_status
+from .latest import query_fleet_state
+from .metrics import metrics
+from .model import GASES
+from .queries import WINDOW, default_resolution, query_graphs, query_points
+from .rollups import RESOLUTIONS
+
+GAS_KEYS = [gas.key for gas in GASES]
+
+
+def parse_list(value, cast=str):
+    """
+    Parse a comma separated query parameter, None if absent.
+    """
+    if not value:
+        return None
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def parse_time(value):
+    """
+    Parse an ISO 8601 (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS) query parameter, None if absent.
+    """
+    if not value:
+        return None
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('Invalid time: {0}'.format(value))
+
+
+def series_json(sensor_id, gas, time, ppb, std):
+    """
+    Columnar JSON object of one series.
+    """
+    return {
+        'sensor_id': int(sensor_id),
+        'gas': gas,
+        'time': np.datetime_as_string(time, unit='s').tolist(),
+        'ppb': ppb.tolist(),
+        'std': std.tolist(),
+    }
+
+
+def select_graphs(session, sensor_ids, gases):
+    """
+    Graph rows of the requested sensors and gases, sensors ascending and gases in GASES order.
+    """
+    graph_rows = [row for row in query_graphs(session, sensor_ids) if gases is None or row[0] in gases]
+    return sorted(graph_rows, key=lambda row: (row[2], GAS_KEYS.index(row[0])))
+
+
+def get_series(sensor_ids, gases, start, end, resolution=None):
+    """
+    Query the requested series through the same indexed path as the graphs.
+    """
+    session = get_session()
+    try:
+        return query_points(session, select_graphs(session, sensor_ids, gases), WINDOW, start, end,
+                            resolution=resolution)
+    finally:
+        session.close()
+
+
+def iter_series(sensor_ids, gases, start, end, resolution=None):
+    """
+    Yield the requested series one graph at a time, so a stream holds a single series in memory.
+    """
+    # The session has to outlive the view while the response streams
+    session = get_session_maker()()
+    try:
+        graph_rows = select_graphs(session, sensor_ids, gases)
+        if graph_rows:
+            resolution = resolution or default_resolution(graph_rows, WINDOW, start, end)
+        for row in graph_rows:
+            for key, columns in query_points(session, [row], WINDOW, start, end, resolution=resolution).items():
+                yield key, columns
+    finally:
+        session.close()
+
+
+@api_view(['GET'])
+@authentication_classes((TokenAuthentication, SessionAuthentication))
+@permission_classes((IsAuthenticated,))
+@gzip_page
+def get_readings(request):
+    """
+    API Controller for calibrated readings as columnar JSON.
+
+    Query parameters:
+        sensor: comma separated sensor ids (default all)
+        gas: comma separated gases out of o3, no2, h2s, so2 (default all)
+        start, end: ISO 8601 times (default the 7 days before each graph's last update)
+        resolution: raw, hourly or daily (default the finest that keeps the span small)
+        output: json (default) or ndjson, one series per line, streamed as each is queried
+                (not format, which the REST framework keeps for picking a renderer)
+    """
+    try:
+        sensor_ids = parse_list(request.GET.get('sensor'), int)
+        gases = parse_list(request.GET.get('gas'))
+        start = parse_time(request.GET.get('start'))
+        end = parse_time(request.GET.get('end'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    unknown = [gas for gas in gases or [] if gas not in GAS_KEYS]
+    if unknown:
+        return JsonResponse({'error': 'Unknown gas: {0}'.format(', '.join(unknown))}, status=400)
+
+    resolution = request.GET.get('resolution')
+    if resolution and resolution not in RESOLUTIONS:
+        return JsonResponse({'error': 'Unknown resolution: {0}'.format(resolution)}, status=400)
+
+    if request.GET.get('output') == 'ndjson':
+        lines = (
+            json.dumps(series_json(sensor_id, gas, *columns)) + '\n'
+            for (sensor_id, gas), columns in iter_series(sensor_ids, gases, start, end, RESOLUTIONS.get(resolution))
+        )
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+    series = get_series(sensor_ids, gases, start, end, RESOLUTIONS.get(resolution))
+    return JsonResponse({
+        'series': [series_json(sensor_id, gas, *columns) for (sensor_id, gas), columns in series.items()]
+    })
+
+
+@api_view(['GET'])
+@authentication_classes((TokenAuthentication, SessionAuthentication))
+@permission_classes((IsAuthenticated,))
+@gzip_page
+def get_fleet_state(request):
+    """
+    API Controller for the location and latest readings of every sensor, read from the snapshot table.
+    """
+    session = get_session()
+    try:
+        sensors = query_fleet_state(session)
+    finally:
+        session.close()
+    return JsonResponse({'sensors': sensors})
+
+
+@api_view(['GET'])
+@authentication_classes((TokenAuthentication, SessionAuthentication))
+@permission_classes((IsAdminUser,))
+def get_pool_status(request):
+    """
+    API Controller for the size and usage of this process's database connection pool, staff only.
+    """
+    return JsonResponse(pool_status())
+
 
 @api_view(['GET'])
-@authentication_classes((TokenAuthentication,))
-def get_data(request):
-    '''
-    API Controller for getting data
-    '''
-    name = request.GET.get('name')
-    data = {"name": name}
-    return JsonResponse(data)
-"""
+@authentication_classes((TokenAuthentication, SessionAuthentication))
+@permission_classes((IsAdminUser,))
+def get_metrics(request):
+    """
+    API Controller for this process's timing spans and counters in the Prometheus text format, staff only.
+    """
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')
@@ -53,6 +53,31 @@ class OpenAir(TethysAppBase):
                 name='user_guide',
                 url='open-air/user-guide',
                 controller='open_air.controllers.user_guide'
+            ),
+            UrlMap(
+                name='export_readings',
+                url='open-air/export',
+                controller='open_air.controllers.export_readings'
+            ),
+            UrlMap(
+                name='api_readings',
+                url='open-air/api/readings',
+                controller='open_air.api.get_readings'
+            ),
+            UrlMap(
+                name='api_fleet_state',
+                url='open-air/api/fleet',
+                controller='open_air.api.get_fleet_state'
+            ),
+            UrlMap(
+                name='api_pool_status',
+                url='open-air/api/pool',
+                controller='open_air.api.get_pool_status'
+            ),
+            UrlMap(
+                name='api_metrics',
+                url='open-air/api/metrics',
+                controller='open_air.api.get_metrics'
             )
         )
 
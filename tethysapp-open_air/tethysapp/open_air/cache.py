@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Rendered graph cache backend: 'memory' (per process), 'django' (shared) or 'none'
+GRAPH_CACHE_BACKEND = os.environ.get('OPEN_AIR_GRAPH_CACHE', 'memory')
+
+# Maximum number of figures kept by the in-memory backend
+GRAPH_CACHE_SIZE = int(os.environ.get('OPEN_AIR_GRAPH_CACHE_SIZE', 256))
+
+# Django cache alias and timeout (seconds) used by the django backend
+GRAPH_CACHE_ALIAS = os.environ.get('OPEN_AIR_GRAPH_CACHE_ALIAS', 'default')
+GRAPH_CACHE_TIMEOUT = int(os.environ.get('OPEN_AIR_GRAPH_CACHE_TIMEOUT', 24 * 60 * 60))
+
+
+class LRUGraphCache(object):
+    """
+    Thread-safe in-process LRU cache of rendered graphs keyed by (sensor_id, gas, window, updatets, revision, ...).
+    """
+
+    def __init__(self, max_size=GRAPH_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, sensor_id):
+        """
+        Drop every cached graph of a sensor.
+        """
+        sensor_id = int(sensor_id)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == sensor_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoGraphCache(object):
+    """
+    Rendered graph cache stored in a Django cache so that every worker process shares it.
+
+    Entries cannot be enumerated, so each sensor has a version number that is part
+    of every key and is bumped to invalidate.
+    """
+
+    def __init__(self, alias=GRAPH_CACHE_ALIAS, timeout=GRAPH_CACHE_TIMEOUT):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def _version_key(self, sensor_id):
+        return 'open_air:graph_version:{0}'.format(int(sensor_id))
+
+    def _key(self, key):
+        version = self.cache.get_or_set(self._version_key(key[0]), 0, None)
+        # Keys hold datetimes and nested tuples, hashed to stay within memcached's 250 characters without spaces
+        digest = hashlib.sha1(':'.join(str(part) for part in key).encode('utf-8')).hexdigest()
+        return 'open_air:graph:{0}:{1}:{2}'.format(int(key[0]), version, digest)
+
+    def get(self, key):
+        return self.cache.get(self._key(key))
+
+    def set(self, key, value):
+        self.cache.set(self._key(key), value, self.timeout)
+
+    def invalidate(self, sensor_id):
+        try:
+            self.cache.incr(self._version_key(sensor_id))
+        except ValueError:
+            self.cache.set(self._version_key(sensor_id), 1, None)
+
+    def clear(self):
+        pass
+
+
+class NullGraphCache(object):
+    """
+    Cache that never stores anything.
+    """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def invalidate(self, sensor_id):
+        pass
+
+    def clear(self):
+        pass
+
+
+def make_graph_cache(backend=GRAPH_CACHE_BACKEND):
+    if backend == 'django':
+        return DjangoGraphCache()
+    if backend == 'none':
+        return NullGraphCache()
+    return LRUGraphCache()
+
+
+graph_cache = make_graph_cache()
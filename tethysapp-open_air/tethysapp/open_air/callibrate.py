@@ -1,46 +1,125 @@
+import os
+
 import pandas as pd
 
-def callibrate_o3(o3df):
-    # read in metadata 
-    ## CHANGE ADDRESS` 
-    meta = pd.read_csv('~/bmoreopen_data/data.csv').set_index('id').drop(28)
-    # we updated code on Sept 25, but didn't update all monitors
-
-    # find the ids of  monitors deployed before Sept. 25, divide by 100
-    old_ids = meta[(pd.to_datetime(meta.install_time) < '2017-09-25 13:45:00')].index
-    # find the monitors deployed after (+ Turner Station, 40, 32, 39), don't 
-    updated_ids = meta[(pd.to_datetime(meta.install_time) > '2017-09-25 13:45:00')].index.append(meta[meta.notes.str.contains('Larry')==True].index)
-    
-    #Resample dataframe from 15 min to hour
-    o3df_cal = o3df.resample('H').mean().copy()
-    #arbitrary threshold for hourly std above which we throw out data
-    o3_thresh = 100
-
-   # loop through the ids and find the callibration codes, m_o3 
-    for sel_id in old_ids: 
-        try: 
-            m_o3 = float(meta.loc[sel_id]['qr_ozone'].dropna().values[0][28:])
-        except AttributeError: 
-            m_o3 = float(meta.loc[sel_id]['qr_ozone'][28:])
-	# now that we have the callibration codes, m_o3
-	# We resample the data taking the mean of each hour, and only select data where the standard deviation in an hour is less than the o3_thresh defined above
-        o3df_cal[sel_id] = (o3df[sel_id].resample('H').mean()[(o3df[sel_id].resample('H').std()<o3_thresh)])/m_o3
-# same thing, but for the updated ids 
-    for sel_id in updated_ids : 
-        try: 
-            m_o3 = float(meta.loc[sel_id]['qr_ozone'].dropna().values[0][28:])
-        except AttributeError: 
-            m_o3 = float(meta.loc[sel_id]['qr_ozone'][28:])
-        o3df_cal[sel_id] = (o3df[sel_id].resample('H').mean()[(o3df[sel_id].resample('H').std()<o3_thresh)])/m_o3
-    
-    # remove columns with all nans   
-    o3df_cal = o3df_cal.dropna(axis=1, how = 'all')
-    # remove data points outside of -300,300
-    o3df_cal[np.abs(o3df_cal) > 300] = np.nan
+from .conversion_helpers import timest2datetime64
+
+# Sensor metadata with the QR codes of each gas sensor
+META_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data.csv')
+
+# Metadata column holding the QR code of each gas, the sensitivity m starts at character 28
+QR_COLUMNS = {'O3': 'qr_ozone', 'NO2': 'qr_no2', 'H2S': 'qr_h2s', 'SO2': 'qr_so2'}
+
+# Sensors whose data is never used
+EXCLUDED_IDS = (28,)
+
+# Arbitrary threshold for hourly std above which we throw out data
+STD_THRESHOLD = 100
+
+# Remove data points outside of -CLIP, CLIP
+CLIP = 300
+
+# Hour of day assumed to be ~0ppb
+BASELINE_HOUR = 6
+
+# Sensors whose calibrated std stays below this are just returning 0s
+MIN_STD = 6
+
+
+def read_meta(path=META_FILE, excluded=EXCLUDED_IDS):
+    """
+    Read sensor metadata indexed by sensor id.
+    """
+    meta = pd.read_csv(path).set_index('id')
+    return meta.drop([sensor_id for sensor_id in excluded if sensor_id in meta.index])
+
+
+def sensitivities(meta, gas):
+    """
+    Sensitivity m of every sensor for a gas, parsed from the QR codes.
+    """
+    m = pd.to_numeric(meta[QR_COLUMNS[gas]].astype(str).str.slice(28), errors='coerce')
+    # Sensors listed more than once keep their first readable code
+    return m.dropna().groupby(level=0).first()
+
+
+def pivot_readings(readings, field):
+    """
+    Turn pulled readings (id, timest, <field>, ...) into a time x sensor id frame of one field.
+    """
+    time = timest2datetime64(readings['timest'].to_numpy())
+    wide = pd.DataFrame({'id': readings['id'].to_numpy(), 'time': time, field: readings[field].to_numpy()})
+    wide = wide.dropna(subset=['time']).pivot_table(index='time', columns='id', values=field, aggfunc='mean')
+    return wide.sort_index()
+
+
+def calibrate_gas(raw, m):
+    """
+    Calibrate a time x sensor id frame of raw 15 minute averages for one gas.
+
+    Returns the hourly calibrated frame (ppb) and the 6am baseline subtracted from each sensor.
+    """
+    # Resample every sensor from 15 min to hour in one pass
+    hourly = raw.resample('60min')
+    mean = hourly.mean()
+    std = hourly.std()
+
+    # Only keep hours whose std is below the threshold, then apply each sensor's sensitivity
+    cal = mean.where(std < STD_THRESHOLD).div(m.reindex(mean.columns), axis=1)
+
+    # remove columns with all nans
+    cal = cal.dropna(axis=1, how='all')
+    # remove data points outside of -CLIP, CLIP
+    cal = cal.mask(cal.abs() > CLIP)
     # subtract 6am data (ie, assume that 6am data is ~0ppb)
-    o3df_cal = o3df_cal.subtract(o3df_cal[o3df_cal.index.hour ==6].mean())
-    # remove data sets that don't have standard deviations above 6 ppb 
-    # (we could be off by factor of 2, so keeping these )
-# some of these are just returning 0s, so we don't care about these
-    o3df_cal = o3df_cal.drop(o3df_cal.std()[o3df_cal.std()<6].index, axis=1)
+    baseline = cal[cal.index.hour == BASELINE_HOUR].mean()
+    cal = cal - baseline
+    # remove data sets that don't have standard deviations above MIN_STD ppb
+    # (we could be off by factor of 2, so keeping these)
+    cal = cal.loc[:, ~(cal.std() < MIN_STD)]
+
+    return cal, baseline.reindex(cal.columns)
+
+
+def calibrate(readings, meta=None, gases=('O3', 'NO2', 'H2S', 'SO2')):
+    """
+    Calibrate every gas of pulled readings for the whole fleet.
+
+    Returns a dict of hourly calibrated frames per gas and the coefficients in zeroes.csv layout.
+    update_sensor computes (avg + zero)/m, so zero = -baseline * m reproduces the baseline subtraction.
+    """
+    if meta is None:
+        meta = read_meta()
+
+    calibrated = {}
+    coefficients = {}
+    for gas in gases:
+        m = sensitivities(meta, gas)
+        cal, baseline = calibrate_gas(pivot_readings(readings, gas + '_avg'), m)
+        calibrated[gas] = cal
+
+        sensor_m = m.reindex(cal.columns)
+        coefficients[(gas + '_avg', 'zero')] = -baseline * sensor_m
+        coefficients[(gas + '_avg', 'm')] = sensor_m
+
+    coefficients = pd.DataFrame(coefficients)
+    coefficients.index.name = 'id'
+    return calibrated, coefficients
+
+
+def write_coefficients(coefficients, path):
+    """
+    Write coefficients in the zeroes.csv layout read by init_sensor_db.
+
+    There is no default path, the zeroes.csv bundled with the app is only replaced on purpose.
+    """
+    coefficients.sort_index().to_csv(path)
+
 
+def callibrate_o3(o3df, meta=None):
+    """
+    Calibrate a time x sensor id frame of raw ozone averages.
+    """
+    if meta is None:
+        meta = read_meta()
+    return calibrate_gas(o3df, sensitivities(meta, 'O3'))[0]
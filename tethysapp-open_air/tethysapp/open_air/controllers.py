@@ -1,55 +1,47 @@
+from datetime import timedelta
+
+from tempfile import SpooledTemporaryFile
+
+from django.http import FileResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render, reverse, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from tethys_sdk.gizmos import MapView, MVView, MVLayer, DataTableView, TextInput, Button
 
 from .model import get_all_sensors, Sensor
-from .model import update_sensor as updatesensor
-from .app import OpenAir as app
-from .helpers import create_temperature_graph, create_ozone_graph, create_no2_graph, create_h2s_graph, create_so2_graph
+from .ingest import update_sensor as updatesensor
+from .ingest import update_all_sensors
+from .scheduler import scheduler
+from .db import get_session, get_session_maker
+from .api import parse_list, parse_time
+from .export import iter_reading_chunks, iter_csv, write_parquet
+from .layers import get_sensor_layer
+from .metrics import incr, span, timed, profiled
+from .helpers import create_temperature_graph, create_humidity_graph, create_sensor_graph
+
+# Widest window (days) the graphs page draws, longer ?days= values are clamped to it
+MAX_WINDOW_DAYS = 365
+
+
+def render_timed(request, template, context, view):
+    """
+    Render a template, timing it (gizmos serialize their figures here) and counting the bytes sent.
+    """
+    with span('render', view=view):
+        response = render(request, template, context)
+    incr('bytes_rendered', len(response.content), view=view)
+    return response
 
 
 @login_required()
+@profiled
+@timed('view', view='home')
 def home(request):
     """
     Controller for the app home page.
     """
-    # Get list of sensors and create sensors MVLayer:
-    sensors = get_all_sensors()
-    features = []
-    lat_list = []
-    lng_list = []
-
-    if sensors is not None:
-        for sensor in sensors:
-            lat_list.append(sensor.latitude)
-            lng_list.append(sensor.longitude)
-
-            sensor_feature = {
-                'type': 'Feature',
-                'geometry': {
-                    'type': 'Point',
-                    'coordinates': [sensor.longitude, sensor.latitude]
-                },
-                'properties': {
-                    'id': sensor.id,
-                    'latitude': sensor.latitude,
-                    'longitude': sensor.longitude
-                }
-            }
-            features.append(sensor_feature)
-
-    # Define GeoJSON FeatureCollection
-    sensors_feature_collection = {
-        'type': 'FeatureCollection',
-        'crs': {
-            'type': 'name',
-            'properties': {
-                'name': 'EPSG:4326'
-            }
-        },
-        'features': features
-    }
+    # Cached GeoJSON of the sensors, with each sensor's latest reading to color markers and fill popups
+    sensors_feature_collection, view_center = get_sensor_layer(include_latest=True)
 
     # Create a Map View Layer
     sensors_layer = MVLayer(
@@ -71,12 +63,6 @@ def home(request):
     )
 
 
-    # Define view centered on sensor locations
-    try:
-        view_center = [sum(lng_list) / float(len(lng_list)), sum(lat_list) / float(len(lat_list))]
-    except ZeroDivisionError:
-        view_center = [-98.6, 39.8]
-
     view_options = MVView(
         projection='EPSG:4326',
         center=view_center,
@@ -97,7 +83,7 @@ def home(request):
         'sensor_map': sensor_map,
     }
 
-    return render(request, 'open_air/home.html', context)
+    return render_timed(request, 'open_air/home.html', context, 'home')
 
 @login_required()
 def list_sensors(request):
@@ -135,8 +121,7 @@ def update_sensor(request):
     Controller for Update Sensor page
     """
     # Get sensors from database
-    Session = app.get_persistent_store_database('sensor_db', as_sessionmaker=True)
-    session = Session()
+    session = get_session()
     all_sensors = session.query(Sensor).all()
 
     # Defaults
@@ -165,6 +150,17 @@ def update_sensor(request):
 
         messages.error(request, "Please fix errors")
 
+    if request.POST and 'update-all-button' in request.POST:
+        results = update_all_sensors()
+        failed = sorted(str(result.sensor_id) for result in results.values() if not result.success)
+
+        # Provide feedback
+        if failed:
+            messages.info(request, 'Unable to update sensors: {0}'.format(', '.join(failed)))
+        else:
+            messages.info(request, 'Successfully updated {0} sensors'.format(len(results)))
+        return redirect(reverse('open_air:home'))
+
     sensor_select_input = TextInput(
         display_text='Sensor',
         name='sensor-select',
@@ -181,6 +177,15 @@ def update_sensor(request):
         submit=True
     )
 
+    update_all_button = Button(
+        display_text='Update All',
+        name='update-all-button',
+        icon='glyphicon glyphicon-refresh',
+        style='primary',
+        attributes={'form': 'update-sensor-form'},
+        submit=True
+    )
+
     cancel_button = Button(
         display_text='Cancel',
         name='cancel-button',
@@ -190,6 +195,7 @@ def update_sensor(request):
     context = {
         'sensor_select_input': sensor_select_input,
         'update_button': update_button,
+        'update_all_button': update_all_button,
         'cancel_button': cancel_button,
     }
 
@@ -207,68 +213,95 @@ def user_guide(request):
     return render(request, 'open_air/user_guide.html', context)
 
 @login_required()
+@profiled
+@timed('view', view='graphs_ajax')
 def graphs_ajax(request, sensor_id):
     """
     Controller for the graphs ajax page.
+
+    Serves stored data, refreshing first only if ?refresh=<minutes> is given and the sensor is older than that.
+    ?days=<n> widens the 7 day window (up to MAX_WINDOW_DAYS), long windows are drawn from the rollups.
     """
-    # Update sensor before viewing
-    if not updatesensor(sensor_id):
-        messages.info(request, 'Unable to update sensor')
+    refresh = request.GET.get('refresh', None)
+    if refresh:
+        try:
+            max_age = timedelta(minutes=float(refresh))
+        except (ValueError, OverflowError):
+            max_age = None
+        if max_age is not None and not scheduler.refresh_if_stale(sensor_id, max_age):
+            messages.info(request, 'Unable to update sensor')
 
-    # Get sensors from database
-    Session = app.get_persistent_store_database('sensor_db', as_sessionmaker=True)
-    session = Session()
-    sensor = session.query(Sensor).get(int(sensor_id))
-
-    if sensor.temperature_graph:
-        temperature_graph_plot = create_temperature_graph(sensor.temperature_graph.id, height='300px')
-    else:
-        temperature_graph_plot = None
-
-    if sensor.ozone_graph:
-        ozone_graph_plot = create_ozone_graph(sensor.ozone_graph.id, height='300px')
-    else:
-        ozone_graph_plot = None
-
-    if sensor.no2_graph:
-        no2_graph_plot = create_no2_graph(sensor.no2_graph.id, height='300px')
-    else:
-        no2_graph_plot = None
-
-    if sensor.h2s_graph:
-        h2s_graph_plot = create_h2s_graph(sensor.h2s_graph.id, height='300px')
-    else:
-        h2s_graph_plot = None
-
-    if sensor.so2_graph:
-        so2_graph_plot = create_so2_graph(sensor.so2_graph.id, height='300px')
-    else:
-        so2_graph_plot = None
+    try:
+        days = float(request.GET.get('days', 7))
+        window = timedelta(days=min(days, MAX_WINDOW_DAYS)) if days > 0 else timedelta(days=7)
+    except (ValueError, OverflowError):
+        window = timedelta(days=7)
+
+    # All gases in one figure from a single session and two queries
+    sensor_graph_plot = create_sensor_graph(sensor_id, window=window)
 
     context = {
-        'temperature_graph_plot': temperature_graph_plot,
-        'ozone_graph_plot': ozone_graph_plot,
-        'no2_graph_plot': no2_graph_plot,
-        'h2s_graph_plot': h2s_graph_plot,
-        'so2_graph_plot': so2_graph_plot,
+        'sensor_graph_plot': sensor_graph_plot,
     }
 
-    session.close()
-    return render(request, 'open_air/graphs_ajax.html', context)
+    return render_timed(request, 'open_air/graphs_ajax.html', context, 'graphs_ajax')
 
 @login_required()
+@profiled
+@timed('view', view='temperature_graph')
 def temperature_graph(request, temperature_graph_id):
     """
-    Controller for the temperature graph page.
+    Controller for the temperature and humidity graph page.
     """
-
-    # Update sensor before viewing
-    if not updatesensor(sensor_id):
-        messages.info(request, 'Unable to update sensor')
-
     temperature_graph_plot = create_temperature_graph(temperature_graph_id)
 
+    # Graphs of a sensor share its id
+    humidity_graph_plot = create_humidity_graph(temperature_graph_id)
+
     context = {
         'temperature_graph_plot': temperature_graph_plot,
+        'humidity_graph_plot': humidity_graph_plot,
     }
-    return render(request, 'open_air/graphs.html', context)
+    return render_timed(request, 'open_air/graphs.html', context, 'temperature_graph')
+
+@login_required()
+def export_readings(request):
+    """
+    Controller for downloading calibrated readings as CSV or Parquet.
+
+    Takes the same sensor, gas, start and end parameters as the readings API, plus format=csv|parquet.
+    """
+    try:
+        sensor_ids = parse_list(request.GET.get('sensor'), int)
+        gases = parse_list(request.GET.get('gas'))
+        start = parse_time(request.GET.get('start'))
+        end = parse_time(request.GET.get('end'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    session = get_session_maker()()
+    chunks = iter_reading_chunks(session, sensor_ids, gases, start, end)
+
+    if request.GET.get('format') == 'parquet':
+        # Parquet needs a seekable file, spill to disk past 16 MB
+        buffer = SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+        try:
+            write_parquet(chunks, buffer)
+        finally:
+            session.close()
+        buffer.seek(0)
+        response = FileResponse(buffer, content_type='application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename="open_air_readings.parquet"'
+        return response
+
+    def stream():
+        # The session has to outlive the view while the response streams
+        try:
+            for text in iter_csv(chunks):
+                yield text
+        finally:
+            session.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="open_air_readings.csv"'
+    return response
@@ -1,38 +1,58 @@
 from datetime import datetime
 
+import numpy as np
+
+# DynamoDB timest values are YYYYMMDDHHMMSS numbers
+
+
+def timest2datetime64(timest):
+    """
+    Convert an array of YYYYMMDDHHMMSS numbers to datetime64[s], NaT where the value is not a valid time.
+    """
+    timest = np.asarray(timest, dtype=np.int64)
+    date, clock = np.divmod(timest, 1000000)
+    year, month_day = np.divmod(date, 10000)
+    month, day = np.divmod(month_day, 100)
+    hour, minute_second = np.divmod(clock, 10000)
+    minute, second = np.divmod(minute_second, 100)
+
+    # Day 1 of each month, counted in months since 1970
+    month_start = ((year - 1970) * 12 + np.clip(month, 1, 12) - 1).astype('datetime64[M]')
+    days_in_month = ((month_start + 1).astype('datetime64[D]') - month_start.astype('datetime64[D]')).astype(np.int64)
+
+    result = month_start.astype('datetime64[D]').astype('datetime64[s]') \
+        + ((day - 1) * 86400 + hour * 3600 + minute * 60 + second).astype('timedelta64[s]')
+
+    valid = (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month) \
+        & (hour < 24) & (minute < 60) & (second < 60) & (timest >= 0)
+    result[~valid] = np.datetime64('NaT')
+    return result
+
+
+def datetime642timest(times):
+    """
+    Convert an array of datetimes to YYYYMMDDHHMMSS numbers (int64), 0 where the time is NaT.
+    """
+    times = np.asarray(times, dtype='datetime64[s]')
+    months = times.astype('datetime64[M]')
+    days = times.astype('datetime64[D]')
+
+    year = months.astype(np.int64) // 12 + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (days - months.astype('datetime64[D]')).astype(np.int64) + 1
+    hour, seconds = np.divmod((times - days.astype('datetime64[s]')).astype(np.int64), 3600)
+    minute, second = np.divmod(seconds, 60)
+
+    result = year * 10000000000 + month * 100000000 + day * 1000000 + hour * 10000 + minute * 100 + second
+    result[np.isnat(times)] = 0
+    return result
+
+
 def str2datetime(time_string):
-    year_ = int(time_string[0:4])
-    month_ = int(time_string[4:6])
-    day_ = int(time_string[6:8])
-    hour_ = int(time_string[8:10])
-    minute_ = int(time_string[10:12])
-    second_ = int(time_string[12:14])
-    return datetime(year=year_, month=month_, day=day_, hour=hour_, minute=minute_, second=second_)
+    time = timest2datetime64([int(time_string)])[0]
+    if np.isnat(time):
+        raise ValueError('Invalid time: {0}'.format(time_string))
+    return time.astype(datetime)
 
 def datetime2str(dt):
-    year = str(dt.year)
-    month = str(dt.month)
-    day = str(dt.day)
-    hour = str(dt.hour)
-    minute = str(dt.minute)
-    second = str(dt.second)
-
-    if len(month) == 1:
-        month = "0" + month
-    if len(day) == 1:
-        day = "0" + day
-    if len(hour) == 1:
-        hour = "0" + hour
-    if len(minute) == 1:
-        minute = "0" + minute
-    if len(second) == 1:
-        second = "0" + second
-
-
-    time_string = year
-    time_string += month
-    time_string += day
-    time_string += hour
-    time_string += minute
-    time_string += second
-    return time_string
+    return str(datetime642timest([np.datetime64(dt, 's')])[0])
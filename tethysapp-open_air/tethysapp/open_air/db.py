@@ -0,0 +1,111 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from django.core.signals import request_finished
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from .app import OpenAir as app
+
+# Connections kept open per process, and extra connections allowed under load
+DB_POOL_SIZE = int(os.environ.get('OPEN_AIR_DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('OPEN_AIR_DB_MAX_OVERFLOW', 10))
+
+# Seconds to wait for a free connection, and seconds before a connection is replaced
+DB_POOL_TIMEOUT = int(os.environ.get('OPEN_AIR_DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('OPEN_AIR_DB_POOL_RECYCLE', 1800))
+
+_engine = None
+_Session = None
+_lock = threading.Lock()
+
+# Session of the current request (or thread), removed when the request finishes
+session_registry = scoped_session(lambda: get_session_maker()())
+
+
+def make_engine(url):
+    """
+    Pooled engine for the sensor_db persistent store.
+    """
+    if make_url(url).get_backend_name() == 'sqlite':
+        # SQLite picks its own pool, sizing options do not apply
+        return create_engine(url)
+    return create_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                         pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+
+
+def use_engine(engine):
+    """
+    Bind the process to an existing engine, e.g. in scripts and benchmarks.
+    """
+    global _engine, _Session
+    with _lock:
+        _engine = engine
+        _Session = sessionmaker(bind=engine)
+    session_registry.remove()
+
+
+def get_engine():
+    """
+    Process-wide engine, created on first use.
+    """
+    global _engine, _Session
+    with _lock:
+        if _engine is None:
+            _engine = make_engine(app.get_persistent_store_database('sensor_db', as_url=True))
+            _Session = sessionmaker(bind=_engine)
+        return _engine
+
+
+def get_session_maker():
+    """
+    Session factory bound to the process-wide engine.
+    """
+    get_engine()
+    return _Session
+
+
+def get_session():
+    """
+    Session of the current request, closed automatically when the request finishes.
+    """
+    return session_registry()
+
+
+def remove_session(**kwargs):
+    session_registry.remove()
+
+
+request_finished.connect(remove_session, dispatch_uid='open_air_remove_session')
+
+
+@contextmanager
+def session_scope(Session=None):
+    """
+    Session for one unit of work: committed on success, rolled back on error and always closed.
+    """
+    session = (Session or get_session_maker())()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def pool_status():
+    """
+    Size and usage of the connection pool.
+    """
+    pool = get_engine().pool
+    status = {'pool': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    if 'size' in status:
+        status['max_overflow'] = DB_MAX_OVERFLOW
+    return status
@@ -0,0 +1,42 @@
+import numpy as np
+
+# Default number of points sent to the browser per trace
+MAX_POINTS = 500
+
+
+def minmax_indices(y, max_points=MAX_POINTS):
+    """
+    Indices of the points to keep so that every bucket keeps its minimum and maximum.
+
+    y is split into max_points // 2 equal-count buckets, so peaks and dips survive
+    while the output never exceeds max_points (plus the first and last point).
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if not max_points or n <= max_points:
+        return np.arange(n)
+
+    buckets = max(max_points // 2, 1)
+    size = -(-n // buckets)  # ceiling division
+    pad = buckets * size - n
+
+    # Pad so that every bucket has the same width, padding never wins a min or max
+    lows = np.concatenate([y, np.full(pad, np.inf)]).reshape(buckets, size)
+    highs = np.concatenate([y, np.full(pad, -np.inf)]).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+
+    keep = np.concatenate([
+        [0, n - 1],
+        offsets + lows.argmin(axis=1),
+        offsets + highs.argmax(axis=1),
+    ])
+    keep = keep[keep < n]
+    return np.unique(keep)
+
+
+def downsample(x, y, *columns, max_points=MAX_POINTS):
+    """
+    Min/max downsample x, y and any number of columns aligned with them, bucketing on y.
+    """
+    keep = minmax_indices(y, max_points)
+    return [np.asarray(column)[keep] for column in (x, y) + columns]
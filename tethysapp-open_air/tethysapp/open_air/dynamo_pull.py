@@ -1,45 +1,195 @@
+import os
+import random
+import threading
+import time
+
+import numpy as np
 import pandas as pd
 import boto3 as bt
-from datetime import datetime, timedelta
-from boto3.dynamodb.conditions import Key, Attr
-from conversion_helpers import datetime2str
-
-def pull_db(sensorid, days, cutoff):
-    # DataFrame
-    df = pd.DataFrame(columns=['id','timest','H2S_avg','H2S_std','NO2_avg','NO2_std','O3_avg','O3_std','SO2_avg','SO2_std','battAV','hum1','hum2','hum3','temp1','temp2','temp3'])
-
-    # Get DynamoDB table
-    dynamodb = bt.resource('dynamodb', region_name='us-west-2')
-    table = dynamodb.Table('BaltimoreOpenAir2018') # Remember to update table here
-    #cutoff = datetime2str(datetime.now() - timedelta(days=days))
-    fe = Key('id').eq(str(sensorid)) & Key('timest').gt(int(cutoff))
-    response = table.query(KeyConditionExpression=fe)
-
-    i = 0
-
-    # Extract points from table response
-    for entry in response['Items']:
-        row = {'id':[entry['id']],
-               'timest':[entry['timest']],
-               'H2S_avg':[entry['H2S_avg']],
-               'H2S_std':[entry['H2S_std']],
-               'NO2_avg':[entry['NO2_avg']],
-               'NO2_std':[entry['NO2_std']],
-               'O3_avg':[entry['O3_avg']],
-               'O3_std':[entry['O3_std']],
-               'SO2_avg':[entry['SO2_avg']],
-               'SO2_std':[entry['SO2_std']],
-               'battAV':[entry['battAV']],
-               'hum1':[entry['hum1']],
-               'hum2':[entry['hum2']],
-               'hum3':[entry['hum3']],
-               'temp1':[entry['temp1']],
-               'temp2':[entry['temp2']],
-               'temp3':[entry['temp3']]}
-        df2 = pd.DataFrame(data=row)
-        df.loc[i]=row
-        i = i+1
-
-    return df
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from .metrics import incr, span
+
+# Point at a local DynamoDB stand-in (e.g. http://localhost:8000) for offline use
+ENDPOINT_URL = os.environ.get('OPEN_AIR_DYNAMODB_ENDPOINT') or None
+
+# Table holding the sensor readings and the region it lives in
+TABLE_NAME = os.environ.get('OPEN_AIR_DYNAMODB_TABLE', 'BaltimoreOpenAir2018')
+REGION = os.environ.get('OPEN_AIR_DYNAMODB_REGION', 'us-west-2')
+
+# Attempts botocore makes per request, backing off adaptively when throttled
+MAX_ATTEMPTS = int(os.environ.get('OPEN_AIR_DYNAMODB_MAX_ATTEMPTS', 10))
+
+# Query pages per second allowed across all pulls of this process (0 for no limit) and the burst size
+READ_RATE = float(os.environ.get('OPEN_AIR_DYNAMODB_READ_RATE', 20))
+READ_BURST = int(os.environ.get('OPEN_AIR_DYNAMODB_READ_BURST', 10))
+
+# Further retries of a page once botocore gives up on throttling, and the base delay (seconds) between them
+THROTTLE_RETRIES = 5
+THROTTLE_BACKOFF = 1.0
+THROTTLING_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+# Attributes stored per reading in the DynamoDB table
+FIELDS = ['id', 'timest', 'H2S_avg', 'H2S_std', 'NO2_avg', 'NO2_std', 'O3_avg', 'O3_std',
+          'SO2_avg', 'SO2_std', 'battAV', 'hum1', 'hum2', 'hum3', 'temp1', 'temp2', 'temp3']
+
+# Attributes that are not decoded to floats
+INT_FIELDS = ['id', 'timest']
+STR_FIELDS = ['battAV']
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket, acquire blocks until a token is available.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+read_limiter = TokenBucket(READ_RATE, READ_BURST)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Process-wide DynamoDB client (thread-safe), created on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            config = Config(retries={'max_attempts': MAX_ATTEMPTS, 'mode': 'adaptive'}, max_pool_connections=50)
+            _client = bt.session.Session().client('dynamodb', region_name=REGION, endpoint_url=ENDPOINT_URL,
+                                                   config=config)
+        return _client
+
+
+def reset_client():
+    """
+    Drop the cached client, e.g. after changing the endpoint or credentials.
+    """
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def query_page(client, **kwargs):
+    """
+    Query one page, waiting on the shared rate limiter and backing off while throttled.
+    """
+    for attempt in range(THROTTLE_RETRIES + 1):
+        read_limiter.acquire()
+        try:
+            return client.query(**kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_ERRORS or attempt == THROTTLE_RETRIES:
+                raise
+            incr('dynamodb_throttled')
+            time.sleep(THROTTLE_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def query_pages(client, **kwargs):
+    """
+    Yield every page of a DynamoDB query, following LastEvaluatedKey.
+    """
+    while True:
+        response = query_page(client, **kwargs)
+        yield response['Items']
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+def attribute_value(value):
+    """
+    Plain value of a low-level attribute ({'N': '1.5'} -> '1.5'), None if missing.
+    """
+    if isinstance(value, dict):
+        return next(iter(value.values()))
+    return value
+
+
+def decode_items(items, fields=FIELDS):
+    """
+    Decode DynamoDB items into a typed, columnar DataFrame.
+    """
+    columns = {}
+    for field in fields:
+        raw = [attribute_value(item.get(field)) for item in items]
+        if field in STR_FIELDS:
+            columns[field] = np.array(raw, dtype=object)
+            continue
+
+        # Decimal and numeric strings decode in one pass, anything else becomes NaN
+        values = pd.to_numeric(pd.Series(raw, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+        if field in INT_FIELDS:
+            values = values.astype(np.int64)
+        columns[field] = values
+
+    return pd.DataFrame(columns, columns=list(fields))
+
+
+def projection(fields):
+    """
+    ProjectionExpression and ExpressionAttributeNames selecting fields.
+    """
+    names = {'#f{0}'.format(i): field for i, field in enumerate(fields)}
+    return ', '.join(sorted(names, key=lambda name: int(name[2:]))), names
+
+
+def pull_db(sensorid, days, cutoff, fields=None, end=None):
+    """
+    Pull the readings of a sensor newer than cutoff (YYYYMMDDHHMMSS), or from cutoff up to end if given.
+
+    Only fields (default FIELDS) are read from DynamoDB and returned.
+    """
+    fields = list(fields or FIELDS)
+    expression, names = projection(fields)
+    names.update({'#id': 'id', '#timest': 'timest'})
+    values = {':id': {'S': str(sensorid)}, ':cutoff': {'N': str(int(cutoff))}}
+
+    # A key condition allows a single comparison of the sort key
+    condition = '#id = :id AND #timest > :cutoff'
+    if end is not None:
+        condition = '#id = :id AND #timest BETWEEN :cutoff AND :end'
+        values[':end'] = {'N': str(int(end))}
+
+    kwargs = {
+        'TableName': TABLE_NAME,
+        'KeyConditionExpression': condition,
+        'ProjectionExpression': expression,
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values,
+    }
 
+    items = []
+    with span('dynamodb_pull'):
+        for page in query_pages(get_client(), **kwargs):
+            incr('dynamodb_pages')
+            items.extend(page)
+    incr('rows_pulled', len(items))
 
+    with span('dynamodb_decode'):
+        return decode_items(items, fields)
@@ -1,193 +1,153 @@
-from datetime import timedelta
+from datetime import datetime
+
 from plotly import graph_objs as go
 from tethys_gizmos.gizmo_options import PlotlyView
 
-from tethysapp.open_air.app import OpenAir as app
-from tethysapp.open_air.model import TemperatureGraph, OzoneGraph, NO2Graph, H2SGraph, SO2Graph
-from tethysapp.open_air.model import OzonePoint, NO2Point, H2SPoint, SO2Point
+from tethysapp.open_air.db import get_session
+from tethysapp.open_air.model import GASES, CLIMATE
+from tethysapp.open_air.downsample import downsample, MAX_POINTS
+from tethysapp.open_air.cache import graph_cache
+from tethysapp.open_air.metrics import incr, span, timed
+from tethysapp.open_air.queries import WINDOW, query_climate_points, query_graphs, query_points
+
+CLIMATE_SERIES = {series.key: series for series in CLIMATE}
 
-def create_temperature_graph(temperature_graph_id, height='520px', width='100%'):
+@timed('graph_build', figure='climate')
+def build_climate_figure(series, graph_id, max_points=MAX_POINTS, window=WINDOW):
     """
-    Generates a plotly view of a temperature graph.
+    Builds the plotly figure of the last 7 days of a temperature or humidity graph, None if it does not exist.
     """
     # Get objects from database
-    Session = app.get_persistent_store_database('sensor_db', as_sessionmaker=True)
-    session = Session()
-    temperature_graph = session.query(TemperatureGraph).get(int(temperature_graph_id))
-    sensor = temperature_graph.sensor
-    time = []
-    temp = []
-    for point in temperature_graph.points:
-        time.append(point.time.hour)
-        temp.append(point.temperature)
+    session = get_session()
+    graph = session.query(series.graph).get(int(graph_id))
+    if graph is None:
+        session.close()
+        return None
 
-    # Build up Plotly plot
-    temperature_graph_go = go.Scatter(
-        x=time,
-        y=temp,
-        name='Temperature Graph for Sensor {0}'.format(sensor.id),
-        line={'color': '#0080ff', 'width': 4, 'shape': 'spline'},
-    )
-    data = [temperature_graph_go]
-    layout = {
-        'title': 'Temperature Graph for Sensor {0}'.format(sensor.id),
-        'xaxis': {'title': 'Time (min)',
-                  'range': [max(time) - timedelta(days=30), max(time)]},
-        'yaxis': {'title': 'Temp (F)'},
-    }
-    figure = {'data': data, 'layout': layout}
-    temperature_graph_plot = PlotlyView(figure, height=height, width=width)
+    # Nothing new since the figure was cached for this updatets and revision
+    key = (graph.sensor_id, series.key, window.total_seconds(), graph.updatets, graph.revision, max_points)
+    figure = graph_cache.get(key)
+    incr('graph_cache', result='miss' if figure is None else 'hit')
+    if figure is not None:
+        session.close()
+        return figure
+
+    with span('graph_query', figure='climate'):
+        time, value = query_climate_points(session, series, graph, window)
     session.close()
-    return temperature_graph_plot
 
-def create_ozone_graph(ozone_graph_id, height='520px', width='100%'):
-    """
-    Generates a plotly view of a ozone graph.
-    """
-    # Get objects from database
-    Session = app.get_persistent_store_database('sensor_db', as_sessionmaker=True)
-    session = Session()
-    ozone_graph = session.query(OzoneGraph).get(ozone_graph_id)
-    ozone_points = session.query(OzonePoint).filter(OzonePoint.ozone_graph == ozone_graph, 
-                                                    OzonePoint.time >= ozone_graph.updatets - timedelta(days=7))
-    time = []
-    ppb = []
-    error = []
-    for point in ozone_points:
-        time.append(point.time)
-        ppb.append(point.ppb)
-        error.append(point.std)
+    # Bound the payload while keeping every bucket's peak and dip
+    time, value = downsample(time, value, max_points=max_points)
 
     # Build up Plotly plot
-    ozone_graph_go = go.Scatter(
+    graph_go = go.Scatter(
         x=time,
-        y=ppb,
-        name='Ozone Graph for Sensor {0}'.format(ozone_graph_id),
-        mode='markers',
-        marker={'color': '#0080ff', 'size': 10},
+        y=value,
+        name='{0} Graph for Sensor {1}'.format(series.label, graph.sensor_id),
+        line={'color': '#0080ff', 'width': 4, 'shape': 'spline'},
     )
-    data = [ozone_graph_go]
+    data = [graph_go]
     layout = {
-        'title': 'Ozone Graph for Sensor {0}'.format(ozone_graph_id),
-        'xaxis': {'title': 'Time',
-                  'range': [max(time) - timedelta(days=7), max(time)]},
-        'yaxis': {'title': 'ppb'},
+        'title': '{0} Graph for Sensor {1}'.format(series.label, graph.sensor_id),
+        'xaxis': {'title': 'Time'},
+        'yaxis': {'title': '{0} ({1})'.format(series.label, series.unit)},
     }
+    if len(time):
+        end = time[-1].astype(datetime)
+        layout['xaxis']['range'] = [end - window, end]
     figure = {'data': data, 'layout': layout}
-    ozone_graph_plot = PlotlyView(figure, height=height, width=width)
-    session.close()
-    return ozone_graph_plot
+    graph_cache.set(key, figure)
+    return figure
 
-def create_no2_graph(no2_graph_id, height='520px', width='100%'):
+def create_temperature_graph(temperature_graph_id, height='520px', width='100%', max_points=MAX_POINTS):
     """
-    Generates a plotly view of a no2 graph.
+    Generates a plotly view of a temperature graph.
     """
-    # Get objects from database
-    Session = app.get_persistent_store_database('sensor_db', as_sessionmaker=True)
-    session = Session()
-    no2_graph = session.query(NO2Graph).get(no2_graph_id)
-    no2_points = session.query(NO2Point).filter(NO2Point.no2_graph == no2_graph,
-                                                NO2Point.time >= no2_graph.updatets - timedelta(days=7))
-    time = []
-    ppb = []
-    error = []
-    for point in no2_points:
-        time.append(point.time)
-        ppb.append(point.ppb)
-        error.append(point.std)
+    figure = build_climate_figure(CLIMATE_SERIES['temperature'], temperature_graph_id, max_points)
+    if figure is None:
+        return None
+    return PlotlyView(figure, height=height, width=width)
 
-    # Build up Plotly plot
-    no2_graph_go = go.Scatter(
-        x=time,
-        y=ppb,
-        name='NO2 Graph for Sensor {0}'.format(no2_graph_id),
-        mode='markers',
-        marker={'color': '#0080ff', 'size': 10},
-    )
-    data = [no2_graph_go]
-    layout = {
-        'title': 'NO2 Graph for Sensor {0}'.format(no2_graph_id),
-        'xaxis': {'title': 'Time',
-                  'range': [max(time) - timedelta(days=7), max(time)]},
-        'yaxis': {'title': 'ppb'},
-    }
-    figure = {'data': data, 'layout': layout}
-    no2_graph_plot = PlotlyView(figure, height=height, width=width)
-    session.close()
-    return no2_graph_plot
+def create_humidity_graph(humidity_graph_id, height='520px', width='100%', max_points=MAX_POINTS):
+    """
+    Generates a plotly view of a humidity graph.
+    """
+    figure = build_climate_figure(CLIMATE_SERIES['humidity'], humidity_graph_id, max_points)
+    if figure is None:
+        return None
+    return PlotlyView(figure, height=height, width=width)
 
-def create_h2s_graph(h2s_graph_id, height='520px', width='100%'):
+@timed('graph_build', figure='sensor')
+def build_sensor_figure(sensor_id, window=WINDOW, max_points=MAX_POINTS):
     """
-    Generates a plotly view of a h2s graph.
+    Builds one plotly figure with a stacked panel per gas of a sensor, sharing the time axis.
+
+    Long windows are drawn from the hourly or daily rollups.
     """
     # Get objects from database
-    Session = app.get_persistent_store_database('sensor_db', as_sessionmaker=True)
-    session = Session()
-    h2s_graph = session.query(H2SGraph).get(h2s_graph_id)
-    h2s_points = session.query(H2SPoint).filter(H2SPoint.h2s_graph == h2s_graph,
-                                                H2SPoint.time >= h2s_graph.updatets - timedelta(days=7))
-    time = []
-    ppb = []
-    error = []
-    for point in h2s_points:
-        time.append(point.time)
-        ppb.append(point.ppb)
-        error.append(point.std)
+    session = get_session()
+    graph_rows = query_graphs(session, [sensor_id])
 
-    # Build up Plotly plot
-    h2s_graph_go = go.Scatter(
-        x=time,
-        y=ppb,
-        name='H2S Graph for Sensor {0}'.format(h2s_graph_id),
-        mode='markers',
-        marker={'color': '#0080ff', 'size': 10},
-    )
-    data = [h2s_graph_go]
+    # Nothing new since the figure was cached for these updatets and revisions, backfilled points
+    # bump a revision without moving updatets
+    versions = tuple(sorted((row[0], row[3], row[4]) for row in graph_rows))
+    cache_key = (int(sensor_id), 'all', window.total_seconds(), versions, max_points)
+    figure = graph_cache.get(cache_key)
+    incr('graph_cache', result='miss' if figure is None else 'hit')
+    if figure is not None:
+        session.close()
+        return figure
+
+    with span('graph_query', figure='sensor'):
+        series = query_points(session, graph_rows, window)
+    session.close()
+
+    labels = {gas.key: gas.label for gas in GASES}
+    panels = len(series)
+    data = []
     layout = {
-        'title': 'H2S Graph for Sensor {0}'.format(h2s_graph_id),
-        'xaxis': {'title': 'Time',
-                  'range': [max(time) - timedelta(days=7), max(time)]},
-        'yaxis': {'title': 'ppb'},
+        'title': 'Sensor {0}'.format(sensor_id),
+        'showlegend': False,
+        'xaxis': {'title': 'Time'},
     }
+    end = None
+
+    for i, ((graph_sensor_id, key), (time, ppb, std)) in enumerate(series.items()):
+        time, ppb = downsample(time, ppb, max_points=max_points)
+        axis = '' if i == 0 else str(i + 1)
+
+        data.append(go.Scatter(
+            x=time,
+            y=ppb,
+            name='{0} Graph for Sensor {1}'.format(labels[key], sensor_id),
+            mode='markers',
+            marker={'color': '#0080ff', 'size': 6},
+            xaxis='x',
+            yaxis='y' + axis,
+        ))
+
+        # First gas on top, each panel with its own slice of the height
+        top = 1 - float(i) / panels
+        layout['yaxis' + axis] = {
+            'title': '{0} (ppb)'.format(labels[key]),
+            'domain': [max(top - 1.0 / panels + 0.04, 0), top],
+        }
+        if len(time):
+            last = time[-1].astype(datetime)
+            end = last if end is None else max(end, last)
+
+    if end is not None:
+        layout['xaxis']['range'] = [end - window, end]
     figure = {'data': data, 'layout': layout}
-    h2s_graph_plot = PlotlyView(figure, height=height, width=width)
-    session.close()
-    return h2s_graph_plot
+    graph_cache.set(cache_key, figure)
+    return figure
 
-def create_so2_graph(so2_graph_id, height='520px', width='100%'):
+def create_sensor_graph(sensor_id, panel_height=250, width='100%', max_points=MAX_POINTS, window=WINDOW):
     """
-    Generates a plotly view of a so2 graph.
+    Generates a single plotly view holding every gas graph of a sensor, None if it has no graphs.
     """
-    # Get objects from database
-    Session = app.get_persistent_store_database('sensor_db', as_sessionmaker=True)
-    session = Session()
-    so2_graph = session.query(SO2Graph).get(so2_graph_id)
-    so2_points = session.query(SO2Point).filter(SO2Point.so2_graph == so2_graph,
-                                                SO2Point.time >= so2_graph.updatets - timedelta(days=7))
-    time = []
-    ppb = []
-    error = []
-    for point in so2_points:
-        time.append(point.time)
-        ppb.append(point.ppb)
-        error.append(point.std)
-
-    # Build up Plotly plot
-    so2_graph_go = go.Scatter(
-        x=time,
-        y=ppb,
-        name='SO2 Graph for Sensor {0}'.format(so2_graph_id),
-        mode='markers',
-        marker={'color': '#0080ff', 'size': 10},
-    )
-    data = [so2_graph_go]
-    layout = {
-        'title': 'SO2 Graph for Sensor {0}'.format(so2_graph_id),
-        'xaxis': {'title': 'Time',
-                  'range': [max(time) - timedelta(days=7), max(time)]},
-        'yaxis': {'title': 'ppb'},
-    }
-    figure = {'data': data, 'layout': layout}
-    so2_graph_plot = PlotlyView(figure, height=height, width=width)
-    session.close()
-    return so2_graph_plot
+    figure = build_sensor_figure(sensor_id, window, max_points)
+    if not figure['data']:
+        return None
+    height = '{0}px'.format(panel_height * len(figure['data']))
+    return PlotlyView(figure, height=height, width=width)
@@ -0,0 +1,431 @@
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .db import get_session_maker
+from .cache import graph_cache
+from .conversion_helpers import datetime2str, timest2datetime64
+from .dynamo_pull import pull_db
+from .latest import update_latest_reading
+from .layers import sensor_layer_cache
+from .locks import AdvisoryLocks, refresh_flights, try_advisory_lock, wait_advisory_lock
+from .metrics import incr, span
+from .model import Sensor, SensorRefresh, GASES, CLIMATE
+from .rollups import update_rollups
+
+logger = logging.getLogger(__name__)
+
+# Number of concurrent DynamoDB pulls during a fleet refresh. Pull threads never check out a database
+# connection, the refresh holds two (its writer session and its advisory locks) whatever the value,
+# so it fits within OPEN_AIR_DB_POOL_SIZE
+INGEST_WORKERS = max(1, int(os.environ.get('OPEN_AIR_INGEST_WORKERS', 8)))
+
+# Start of the data for graphs that have never been updated
+EPOCH = datetime(2017, 1, 1)
+
+# Minutes before each graph's updatets that every refresh pulls again, picking up late-arriving records
+INGEST_OVERLAP = timedelta(minutes=int(os.environ.get('OPEN_AIR_INGEST_OVERLAP', 60)))
+
+# DynamoDB attributes the gas and climate graphs are built from
+INGEST_FIELDS = ['timest'] + [gas.field + suffix for gas in GASES for suffix in ('_avg', '_std')] \
+    + [field for series in CLIMATE for field in series.fields]
+
+RefreshResult = namedtuple('RefreshResult', ['sensor_id', 'success', 'points', 'error'])
+
+
+def get_graphs(sensor):
+    """
+    Get the graphs of a sensor keyed by gas or climate series, creating any that do not exist.
+    """
+    graphs = {}
+    for series in GASES + CLIMATE:
+        graph = getattr(sensor, series.relationship)
+        if not graph:
+            graph = series.graph(id=sensor.id, updatets=EPOCH, sensor=sensor)
+            setattr(sensor, series.relationship, graph)
+        graphs[series.key] = graph
+    return graphs
+
+
+def get_cutoff(graphs):
+    """
+    Get the DynamoDB cutoff timestamp covering every graph of a sensor and the overlap window.
+
+    Graphs still at EPOCH are left out once another graph has points, so a series the sensor never
+    reports (e.g. a missing probe) does not make every refresh pull its whole history again.
+    """
+    populated = [graph.updatets for graph in graphs.values() if graph.updatets and graph.updatets > EPOCH]
+    return datetime2str(min(populated or [EPOCH]) - INGEST_OVERLAP)
+
+
+def series_fields(series):
+    """
+    DynamoDB attributes a gas or climate graph is built from.
+    """
+    fields = getattr(series, 'fields', None)
+    if fields is not None:
+        return list(fields)
+    return [series.field + '_avg', series.field + '_std']
+
+
+def get_backfill(graphs):
+    """
+    Get the keys of the graphs of a sensor still at EPOCH while others are populated, and the end of the
+    history they miss (the refreshes' cutoff), or ([], None) if there is nothing to backfill.
+    """
+    missing = [key for key, graph in graphs.items() if not graph.updatets or graph.updatets <= EPOCH]
+    if not missing or len(missing) == len(graphs):
+        return [], None
+    return missing, get_cutoff(graphs)
+
+
+def stored_times(session, series, graph_id, start):
+    """
+    Times of the points a graph already stores from start on, as datetime64[ns].
+    """
+    point = series.point
+    rows = session.query(point.time).filter(getattr(point, series.foreign_key) == graph_id, point.time >= start).all()
+    return np.array([row[0] for row in rows], dtype='datetime64[ns]')
+
+
+def select_new(session, series, graph, times, valid):
+    """
+    Mask of the valid points within the overlap window of a graph that it does not store yet.
+    """
+    new = np.asarray(times > graph.updatets - INGEST_OVERLAP) & valid
+    if new.any():
+        new &= ~np.isin(times.values, stored_times(session, series, graph.id, times[new].min().to_pydatetime()))
+    return new
+
+
+def write_points(session, sensor, graphs, df):
+    """
+    Calibrate a pulled frame and bulk insert the points each graph does not store yet.
+
+    Temperature and humidity points are the mean of the sensor's three probes.
+    """
+    times = pd.DatetimeIndex(timest2datetime64(df['timest'].to_numpy()))
+    count = 0
+    latest = {}
+
+    for gas in GASES:
+        if gas.field + '_avg' not in df.columns:
+            continue
+        graph = graphs[gas.key]
+        m = getattr(sensor, gas.m)
+        z = getattr(sensor, gas.z)
+
+        # Calibrate the whole column at once, dropping points that failed to decode
+        ppb = (df[gas.field + '_avg'].to_numpy() + z) / m
+        std = df[gas.field + '_std'].to_numpy() / m
+        new = select_new(session, gas, graph, times, np.isfinite(ppb) & np.isfinite(std))
+        if not new.any():
+            continue
+
+        new_times = times[new]
+        insert_points(session, gas.point.__table__, gas.foreign_key, graph.id, new_times,
+                      ppb=ppb[new], std=std[new])
+        graph.revision = gas.graph.revision + 1
+        update_rollups(session, gas, sensor.id, graph.id, new_times)
+        # Late arrivals fill gaps without moving the graph back, the revision tells caches they changed
+        last = new_times.argmax()
+        if new_times[last] > graph.updatets:
+            graph.updatets = new_times[last].to_pydatetime()
+            latest[gas.key] = float(ppb[new][last])
+        incr('points_inserted', int(new.sum()), series=gas.key)
+        count += int(new.sum())
+
+    for series in CLIMATE:
+        if not set(series.fields).issubset(df.columns):
+            continue
+        graph = graphs[series.key]
+
+        # Average the probes that reported, rows where none did stay NaN
+        probes = df[list(series.fields)].to_numpy(dtype=np.float64)
+        reported = np.isfinite(probes).sum(axis=1)
+        values = np.nansum(probes, axis=1) / np.maximum(reported, 1)
+        values[reported == 0] = np.nan
+        new = select_new(session, series, graph, times, np.isfinite(values))
+        if not new.any():
+            continue
+
+        new_times = times[new]
+        insert_points(session, series.point.__table__, series.foreign_key, graph.id, new_times,
+                      **{series.column: values[new]})
+        graph.revision = series.graph.revision + 1
+        last = new_times.argmax()
+        if new_times[last] > graph.updatets:
+            graph.updatets = new_times[last].to_pydatetime()
+            latest[series.key] = float(values[new][last])
+        incr('points_inserted', int(new.sum()), series=series.key)
+        count += int(new.sum())
+
+    # Snapshot commits or rolls back together with the points
+    if latest:
+        update_latest_reading(session, sensor.id, max(graph.updatets for graph in graphs.values()), latest)
+
+    return count
+
+
+def record_refresh(session, sensor_id, time=None):
+    """
+    Upsert when a sensor was last refreshed within the caller's transaction, so every process sees it.
+    """
+    row = session.query(SensorRefresh).get(int(sensor_id))
+    if row is None:
+        row = SensorRefresh(sensor_id=int(sensor_id))
+        session.add(row)
+    row.time = time or datetime.now()
+
+
+def insert_statement(table, foreign_key, dialect):
+    """
+    INSERT into a point table that skips rows whose graph and time are already stored.
+    """
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=[foreign_key, 'time'])
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=[foreign_key, 'time'])
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    return table.insert()
+
+
+def insert_points(session, table, foreign_key, graph_id, times, chunk_size=5000, **columns):
+    """
+    Bulk insert points for one graph with batched executemany INSERTs, one array per value column.
+
+    Points already stored for the same graph and time, e.g. by a concurrent refresh, are skipped.
+    """
+    names = list(columns)
+    records = [
+        dict(zip(names, values), **{foreign_key: graph_id, 'time': time})
+        for time, values in zip(times.to_pydatetime(), zip(*[columns[name].tolist() for name in names]))
+    ]
+    statement = insert_statement(table, foreign_key, session.get_bind().dialect.name)
+    for start in range(0, len(records), chunk_size):
+        session.execute(statement, records[start:start + chunk_size])
+
+
+def update_sensor(sensor_id, Session=None, wait=True):
+    """
+    Update the graph data of a particular sensor
+
+    Only one refresh of a sensor runs at a time, in this process and (on PostgreSQL) across processes.
+    Other callers wait for it to finish, or with wait=False return at once and serve the stored data.
+    """
+    if Session is None:
+        Session = get_session_maker()
+
+    with refresh_flights.flight(int(sensor_id), wait=wait) as leader:
+        if not leader:
+            incr('refresh_coalesced')
+            return True
+        return refresh_sensor(sensor_id, Session, wait)
+
+
+def refresh_sensor(sensor_id, Session, wait=True):
+    """
+    Pull and write one sensor under its advisory lock.
+    """
+    session = Session()
+
+    try:
+        # Another process is refreshing this sensor, its points are as good as ours; if it takes longer
+        # than the wait allows, the stored data is served as is
+        if not try_advisory_lock(session, sensor_id):
+            incr('refresh_coalesced')
+            if wait and not wait_advisory_lock(session, sensor_id):
+                incr('refresh_wait_timeouts')
+            session.rollback()
+            return True
+
+        # Get sensor object
+        sensor = session.query(Sensor).get(int(sensor_id))
+        graphs = get_graphs(sensor)
+
+        # Graph rows must exist before points can reference them
+        session.flush()
+
+        df = pull_db(sensor_id, 30, get_cutoff(graphs), INGEST_FIELDS)
+        with span('ingest_write'):
+            count = write_points(session, sensor, graphs, df)
+        record_refresh(session, sensor_id)
+
+        # Wrap up db session
+        with span('ingest_commit'):
+            session.commit()
+        if count:
+            graph_cache.invalidate(sensor_id)
+            sensor_layer_cache.invalidate_latest()
+
+    except Exception:
+        logger.exception('Unable to update sensor %s', sensor_id)
+        incr('ingest_failures')
+        session.rollback()
+        return False
+
+    finally:
+        session.close()
+
+    return True
+
+
+def backfill_sensor(sensor_id, Session=None):
+    """
+    Pull the history of the graphs of a sensor that were never populated while its others were, e.g. after a
+    probe was added. Refreshes leave such graphs out of their cutoff, so this is run explicitly, once.
+
+    Returns the number of points written, None if the sensor was being refreshed.
+    """
+    if Session is None:
+        Session = get_session_maker()
+
+    with refresh_flights.flight(int(sensor_id), wait=False) as leader:
+        if not leader:
+            return None
+
+        session = Session()
+        try:
+            if not try_advisory_lock(session, sensor_id):
+                session.rollback()
+                return None
+
+            sensor = session.query(Sensor).get(int(sensor_id))
+            graphs = get_graphs(sensor)
+            session.flush()
+
+            keys, end = get_backfill(graphs)
+            if not keys:
+                session.commit()
+                return 0
+
+            fields = ['timest'] + [field for series in GASES + CLIMATE if series.key in keys
+                                   for field in series_fields(series)]
+            df = pull_db(sensor_id, 30, datetime2str(EPOCH - INGEST_OVERLAP), fields, end=end)
+            with span('ingest_write'):
+                count = write_points(session, sensor, graphs, df)
+            session.commit()
+            if count:
+                graph_cache.invalidate(sensor_id)
+                sensor_layer_cache.invalidate_latest()
+            logger.info('Backfilled %d points of %s for sensor %s', count, ', '.join(keys), sensor_id)
+            return count
+
+        except Exception:
+            session.rollback()
+            raise
+
+        finally:
+            session.close()
+
+
+def backfill_sensors(Session=None, sensor_ids=None):
+    """
+    Backfill every sensor (or only sensor_ids) one at a time.
+
+    Returns the points written keyed by sensor id, None for sensors that were being refreshed or failed.
+    """
+    if Session is None:
+        Session = get_session_maker()
+    session = Session()
+    try:
+        query = session.query(Sensor.id).order_by(Sensor.id)
+        if sensor_ids is not None:
+            query = query.filter(Sensor.id.in_([int(sensor_id) for sensor_id in sensor_ids]))
+        ids = [row[0] for row in query.all()]
+    finally:
+        session.close()
+
+    results = {}
+    for sensor_id in ids:
+        try:
+            results[sensor_id] = backfill_sensor(sensor_id, Session)
+        except Exception:
+            logger.exception('Unable to backfill sensor %s', sensor_id)
+            incr('ingest_failures')
+            results[sensor_id] = None
+    return results
+
+
+def update_all_sensors(Session=None, max_workers=INGEST_WORKERS, sensor_ids=None):
+    """
+    Refresh every sensor (or only sensor_ids), pulling from DynamoDB concurrently and writing from a single session.
+
+    Sensors already being refreshed by another caller, in this process or (on PostgreSQL) another one,
+    are skipped before anything is pulled and reported with 0 points.
+    Returns a RefreshResult per sensor id.
+    """
+    if Session is None:
+        Session = get_session_maker()
+    session = Session()
+    locks = AdvisoryLocks(session.get_bind())
+    results = {}
+    claimed = set()
+
+    try:
+        query = session.query(Sensor)
+        if sensor_ids is not None:
+            query = query.filter(Sensor.id.in_([int(sensor_id) for sensor_id in sensor_ids]))
+        sensors = {}
+        for sensor in query.all():
+            leader, _ = refresh_flights.claim(sensor.id)
+            if leader and locks.try_lock(sensor.id):
+                claimed.add(sensor.id)
+                sensors[sensor.id] = sensor
+            else:
+                if leader:
+                    refresh_flights.release(sensor.id)
+                incr('refresh_coalesced')
+                results[sensor.id] = RefreshResult(sensor.id, True, 0, None)
+
+        # Make sure every graph row exists before pulling so cutoffs are known up front
+        graphs = {sensor_id: get_graphs(sensor) for sensor_id, sensor in sensors.items()}
+        session.commit()
+        cutoffs = {sensor_id: get_cutoff(sensor_graphs) for sensor_id, sensor_graphs in graphs.items()}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(pull_db, sensor_id, 30, cutoff, INGEST_FIELDS): sensor_id
+                for sensor_id, cutoff in cutoffs.items()
+            }
+
+            # This thread is the only writer; each sensor commits on its own
+            for future in as_completed(futures):
+                sensor_id = futures[future]
+                try:
+                    df = future.result()
+                    with span('ingest_write'):
+                        count = write_points(session, sensors[sensor_id], graphs[sensor_id], df)
+                    record_refresh(session, sensor_id)
+                    with span('ingest_commit'):
+                        session.commit()
+                    if count:
+                        graph_cache.invalidate(sensor_id)
+                        sensor_layer_cache.invalidate_latest()
+                    results[sensor_id] = RefreshResult(sensor_id, True, count, None)
+                except Exception as e:
+                    logger.exception('Unable to update sensor %s', sensor_id)
+                    incr('ingest_failures')
+                    session.rollback()
+                    results[sensor_id] = RefreshResult(sensor_id, False, 0, str(e))
+                finally:
+                    locks.unlock(sensor_id)
+                    refresh_flights.release(sensor_id)
+                    claimed.discard(sensor_id)
+
+    finally:
+        try:
+            locks.close()
+        finally:
+            for sensor_id in claimed:
+                refresh_flights.release(sensor_id)
+            session.close()
+
+    return results
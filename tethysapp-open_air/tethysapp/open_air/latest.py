@@ -0,0 +1,67 @@
+from sqlalchemy import literal, select, union_all
+
+from .model import Sensor, LatestReading, GASES, CLIMATE
+
+# Series kept in the snapshot, each a LatestReading column
+LATEST_KEYS = [gas.key for gas in GASES] + [series.key for series in CLIMATE]
+
+
+def update_latest_reading(session, sensor_id, time, values):
+    """
+    Upsert the snapshot row of a sensor within the caller's transaction.
+
+    values maps series keys to their newest value, series without new points keep theirs.
+    """
+    row = session.query(LatestReading).get(int(sensor_id))
+    if row is None:
+        row = LatestReading(sensor_id=int(sensor_id))
+        session.add(row)
+
+    for key, value in values.items():
+        setattr(row, key, value)
+    if row.time is None or time > row.time:
+        row.time = time
+
+
+def rebuild_latest_readings(session):
+    """
+    Recompute every snapshot row from the point at each graph's updatets.
+    """
+    branches = []
+    for series in GASES + CLIMATE:
+        point = series.point
+        value = getattr(point, getattr(series, 'column', 'ppb'))
+        branches.append(
+            select([literal(series.key).label('key'), series.graph.sensor_id, point.time, value.label('value')])
+            .select_from(series.graph.__table__.join(point.__table__,
+                                                     getattr(point, series.foreign_key) == series.graph.id))
+            .where(point.time == series.graph.updatets)
+        )
+
+    latest = {}
+    for key, sensor_id, time, value in session.execute(union_all(*branches)).fetchall():
+        times, values = latest.setdefault(sensor_id, ([], {}))
+        times.append(time)
+        values[key] = value
+
+    session.query(LatestReading).delete(synchronize_session=False)
+    for sensor_id, (times, values) in latest.items():
+        update_latest_reading(session, sensor_id, max(times), values)
+
+
+def query_fleet_state(session):
+    """
+    Get the location and latest readings of every sensor in one query on the snapshot's primary key.
+    """
+    columns = [getattr(LatestReading, key) for key in LATEST_KEYS]
+    rows = session.query(Sensor.id, Sensor.latitude, Sensor.longitude, LatestReading.time, *columns) \
+                  .outerjoin(LatestReading, LatestReading.sensor_id == Sensor.id) \
+                  .order_by(Sensor.id).all()
+
+    fleet = []
+    for row in rows:
+        latest = dict((key, value) for key, value in zip(LATEST_KEYS, row[4:]) if value is not None)
+        if row[3] is not None:
+            latest['time'] = row[3].isoformat()
+        fleet.append({'id': row[0], 'latitude': row[1], 'longitude': row[2], 'latest': latest})
+    return fleet
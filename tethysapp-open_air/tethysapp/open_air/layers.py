@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, inspect
+
+from .db import get_session
+from .latest import query_fleet_state
+from .model import Sensor
+
+# Seconds a cached map layer is served before it is rebuilt, bounds staleness across worker processes
+SENSOR_LAYER_TIMEOUT = int(os.environ.get('OPEN_AIR_SENSOR_LAYER_TIMEOUT', 300))
+
+# Used where there are no sensor locations to center on
+DEFAULT_CENTER = [-98.6, 39.8]
+
+
+class SensorLayerCache(object):
+    """
+    Thread-safe in-process cache of the sensor map layer payloads, with and without latest readings.
+    """
+
+    def __init__(self, timeout=SENSOR_LAYER_TIMEOUT):
+        self.timeout = timeout
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, include_latest):
+        with self._lock:
+            entry = self._entries.get(include_latest)
+        if entry is None or time.monotonic() - entry[0] > self.timeout:
+            return None
+        return entry[1]
+
+    def set(self, include_latest, payload):
+        with self._lock:
+            self._entries[include_latest] = (time.monotonic(), payload)
+
+    def invalidate_latest(self):
+        """
+        Drop the payload carrying latest readings, e.g. after new points are ingested.
+        """
+        with self._lock:
+            self._entries.pop(True, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+sensor_layer_cache = SensorLayerCache()
+
+
+def _clear_sensor_layer(mapper, connection, target):
+    sensor_layer_cache.clear()
+
+
+def _clear_changed_sensor_layer(mapper, connection, target):
+    # Flushes that only attach graphs to a sensor leave its columns, and the layers, as they are
+    state = inspect(target)
+    if any(state.attrs[prop.key].history.has_changes() for prop in mapper.column_attrs):
+        sensor_layer_cache.clear()
+
+
+# Sensors added, moved or removed through the ORM
+event.listen(Sensor, 'after_insert', _clear_sensor_layer)
+event.listen(Sensor, 'after_update', _clear_changed_sensor_layer)
+event.listen(Sensor, 'after_delete', _clear_sensor_layer)
+
+
+def build_sensor_layer(session, include_latest=False):
+    """
+    Build the GeoJSON FeatureCollection of every sensor and the center of their locations.
+    """
+    if include_latest:
+        sensors = query_fleet_state(session)
+    else:
+        sensors = [
+            {'id': sensor_id, 'latitude': latitude, 'longitude': longitude}
+            for sensor_id, latitude, longitude in
+            session.query(Sensor.id, Sensor.latitude, Sensor.longitude).order_by(Sensor.id).all()
+        ]
+
+    features = []
+    for properties in sensors:
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [properties['longitude'], properties['latitude']]
+            },
+            'properties': properties
+        })
+
+    feature_collection = {
+        'type': 'FeatureCollection',
+        'crs': {
+            'type': 'name',
+            'properties': {
+                'name': 'EPSG:4326'
+            }
+        },
+        'features': features
+    }
+
+    if sensors:
+        center = [sum(sensor['longitude'] for sensor in sensors) / float(len(sensors)),
+                  sum(sensor['latitude'] for sensor in sensors) / float(len(sensors))]
+    else:
+        center = DEFAULT_CENTER
+
+    return feature_collection, center
+
+
+def get_sensor_layer(include_latest=False):
+    """
+    Get the cached sensor layer FeatureCollection and map center, building it on a miss.
+    """
+    payload = sensor_layer_cache.get(include_latest)
+    if payload is None:
+        session = get_session()
+        try:
+            payload = build_sensor_layer(session, include_latest)
+        finally:
+            session.close()
+        sensor_layer_cache.set(include_latest, payload)
+    return payload
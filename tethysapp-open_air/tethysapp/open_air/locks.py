@@ -0,0 +1,153 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+# Seconds a caller waits on another refresh of the same sensor before giving up and serving what is stored
+REFRESH_WAIT_TIMEOUT = int(os.environ.get('OPEN_AIR_REFRESH_WAIT_TIMEOUT', 30))
+
+# First key of the two-key PostgreSQL advisory locks taken per sensor ('OA'), the sensor id is the second
+ADVISORY_NAMESPACE = 0x4F41
+
+# First key of the advisory lock held by the one process running a scheduler pass ('OS')
+SCHEDULER_NAMESPACE = 0x4F53
+
+# SQLSTATE of lock_not_available, raised when lock_timeout expires
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+class SingleFlight(object):
+    """
+    In-process map of the refreshes in flight, so only one runs per key and other callers wait on it.
+    """
+
+    def __init__(self):
+        self._flights = {}  #: key -> threading.Event set when the flight lands
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """
+        Start a flight for key: (True, None), or (False, its Event) if one is already in flight.
+        """
+        with self._lock:
+            event = self._flights.get(key)
+            if event is not None:
+                return False, event
+            self._flights[key] = threading.Event()
+            return True, None
+
+    def release(self, key):
+        with self._lock:
+            event = self._flights.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._flights
+
+    @contextmanager
+    def flight(self, key, wait=True, timeout=REFRESH_WAIT_TIMEOUT):
+        """
+        Yield True to the one caller that should do the work, False to the others.
+
+        With wait, the others are held until the flight lands (or timeout seconds pass) first.
+        """
+        leader, event = self.claim(key)
+        if not leader:
+            if wait:
+                event.wait(timeout)
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.release(key)
+
+
+refresh_flights = SingleFlight()
+
+
+def try_advisory_lock(session, sensor_id):
+    """
+    Take the sensor's advisory lock for the rest of the session's transaction, False if another one holds it.
+
+    Always True outside PostgreSQL.
+    """
+    if session.get_bind().dialect.name != 'postgresql':
+        return True
+    return session.execute(text('SELECT pg_try_advisory_xact_lock(:namespace, :key)'),
+                           {'namespace': ADVISORY_NAMESPACE, 'key': int(sensor_id)}).scalar()
+
+
+def wait_advisory_lock(session, sensor_id, timeout=REFRESH_WAIT_TIMEOUT):
+    """
+    Block until the sensor's advisory lock is free, then hold it for the transaction.
+
+    False if timeout seconds pass first, the session's transaction is rolled back then.
+    """
+    if session.get_bind().dialect.name != 'postgresql':
+        return True
+    try:
+        session.execute(text('SET LOCAL lock_timeout = {0:d}'.format(int(timeout * 1000))))
+        session.execute(text('SELECT pg_advisory_xact_lock(:namespace, :key)'),
+                        {'namespace': ADVISORY_NAMESPACE, 'key': int(sensor_id)})
+    except OperationalError as e:
+        if getattr(e.orig, 'pgcode', None) != LOCK_NOT_AVAILABLE:
+            raise
+        session.rollback()
+        return False
+    return True
+
+
+class AdvisoryLocks(object):
+    """
+    Session-level advisory locks of sensors (or other keys of namespace), held on a dedicated connection across
+    transactions until released.
+
+    Every lock is granted outside PostgreSQL.
+    """
+
+    def __init__(self, engine, namespace=ADVISORY_NAMESPACE):
+        self.namespace = namespace
+        self.connection = None
+        if engine.dialect.name == 'postgresql':
+            self.connection = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        self.held = set()
+
+    def try_lock(self, sensor_id):
+        """
+        Take the sensor's lock unless another session holds it.
+        """
+        if self.connection is None:
+            return True
+        locked = self.connection.execute(text('SELECT pg_try_advisory_lock(:namespace, :key)'),
+                                         {'namespace': self.namespace, 'key': int(sensor_id)}).scalar()
+        if locked:
+            self.held.add(int(sensor_id))
+        return locked
+
+    def unlock(self, sensor_id):
+        if self.connection is None or int(sensor_id) not in self.held:
+            return
+        self.connection.execute(text('SELECT pg_advisory_unlock(:namespace, :key)'),
+                                {'namespace': self.namespace, 'key': int(sensor_id)})
+        self.held.discard(int(sensor_id))
+
+    def close(self):
+        """
+        Release every lock still held and return the connection to the pool.
+        """
+        if self.connection is None:
+            return
+        try:
+            for sensor_id in list(self.held):
+                self.unlock(sensor_id)
+        except Exception:
+            # Never hand a connection that may still hold locks back to the pool
+            self.connection.invalidate()
+            raise
+        finally:
+            self.connection.close()
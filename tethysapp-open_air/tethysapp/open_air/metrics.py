@@ -0,0 +1,165 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Log every span and its duration (1) in addition to keeping the aggregates
+METRICS_LOG = os.environ.get('OPEN_AIR_METRICS_LOG', '0') == '1'
+
+# Allow staff to profile a request with ?profile=1 (1), and the fraction of requests profiled into the log
+PROFILING = os.environ.get('OPEN_AIR_PROFILING', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('OPEN_AIR_PROFILE_SAMPLE_RATE', 0))
+
+# Upper bounds (seconds) of the span duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+PREFIX = 'open_air_'
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, value.replace('"', '\\"')) for name, value in pairs) + '}'
+
+
+class Metrics(object):
+    """
+    Thread-safe in-process counters and span duration histograms, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}  #: (name, labels) -> value
+        self._spans = {}  #: (name, labels) -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1, **labels):
+        """
+        Add value to the counter name{labels}.
+        """
+        key = (name, label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Record one duration of the span name{labels}.
+        """
+        key = (name, label_key(labels))
+        with self._lock:
+            histogram = self._spans.get(key)
+            if histogram is None:
+                histogram = self._spans[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[bisect_left(self.buckets, seconds)] += 1
+            histogram[-1] += seconds
+
+    @contextmanager
+    def span(self, name, **labels):
+        """
+        Time the enclosed block as the span name{labels}, errors included.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(name, seconds, **labels)
+            if METRICS_LOG:
+                logger.info('span=%s seconds=%.6f %s', name, seconds,
+                            ' '.join('{0}={1}'.format(*pair) for pair in label_key(labels)))
+
+    def render(self):
+        """
+        Prometheus text exposition of every counter and span.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            spans = sorted((key, list(histogram)) for key, histogram in self._spans.items())
+
+        lines = []
+        previous = None
+        for (name, labels), value in counters:
+            metric = PREFIX + name + '_total'
+            if metric != previous:
+                lines.append('# TYPE {0} counter'.format(metric))
+                previous = metric
+            lines.append('{0}{1} {2}'.format(metric, format_labels(labels), value))
+
+        for (name, labels), histogram in spans:
+            metric = PREFIX + name + '_seconds'
+            if metric != previous:
+                lines.append('# TYPE {0} histogram'.format(metric))
+                previous = metric
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], histogram[:-1]):
+                cumulative += count
+                lines.append('{0}_bucket{1} {2}'.format(metric, format_labels(labels, [('le', str(bound))]), cumulative))
+            lines.append('{0}_sum{1} {2}'.format(metric, format_labels(labels), histogram[-1]))
+            lines.append('{0}_count{1} {2}'.format(metric, format_labels(labels), cumulative))
+
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._spans.clear()
+
+
+metrics = Metrics()
+span = metrics.span
+incr = metrics.incr
+
+
+def timed(name, **labels):
+    """
+    Decorator timing every call of a function as the span name{labels}.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profiled(view):
+    """
+    Profile a controller with cProfile when a staff user asks with ?profile=1 (and OPEN_AIR_PROFILING is on),
+    returning the report instead of the page, or for a random OPEN_AIR_PROFILE_SAMPLE_RATE share of requests,
+    logging the report.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        requested = PROFILING and request.GET.get('profile') and request.user.is_staff
+        sampled = PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE
+        if not (requested or sampled):
+            return view(request, *args, **kwargs)
+
+        profiler = cProfile.Profile()
+        response = profiler.runcall(view, request, *args, **kwargs)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(40)
+
+        if requested:
+            return HttpResponse(stream.getvalue(), content_type='text/plain')
+        logger.info('Profile of %s:\n%s', request.get_full_path(), stream.getvalue())
+        return response
+
+    return wrapper
@@ -1,23 +1,18 @@
-import json
-import boto3
-import decimal
+import os
 import pandas as pd
 import numpy as np
-from boto3.dynamodb.conditions import Key, Attr
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, Float, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, Float, String, ForeignKey, DateTime, Index, func, inspect, select, text
 from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
+from collections import namedtuple
 
 
-from .app import OpenAir as app
-from .conversion_helpers import datetime2str, str2datetime
-from .dynamo_pull import pull_db
+from .db import get_session
 
 Base = declarative_base()
 
-loc_file = 'BaltimoreOpenAir2018_results.csv'
-cal_file = 'zeroes.csv'
+loc_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'BaltimoreOpenAir2018_results.csv')
+cal_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zeroes.csv')
 
 #callibrated_file = 'callibrated.csv'
 
@@ -45,6 +40,7 @@ class Sensor(Base):
 
     # Relationships
     temperature_graph = relationship('TemperatureGraph', back_populates='sensor', uselist=False)
+    humidity_graph = relationship('HumidityGraph', back_populates='sensor', uselist=False)
     ozone_graph = relationship('OzoneGraph', back_populates='sensor', uselist=False)
     no2_graph = relationship('NO2Graph', back_populates='sensor', uselist=False)
     h2s_graph = relationship('H2SGraph', back_populates='sensor', uselist=False)
@@ -61,6 +57,7 @@ class OzoneGraph(Base):
     id = Column(Integer, primary_key=True)
     sensor_id = Column(ForeignKey('sensors.id'))
     updatets = Column(DateTime)
+    revision = Column(Integer, nullable=False, default=0, server_default='0')  #: bumped by every insert of points
 
     # Relationships
     sensor = relationship('Sensor', back_populates='ozone_graph')
@@ -76,6 +73,7 @@ class NO2Graph(Base):
     id = Column(Integer, primary_key=True)
     sensor_id = Column(ForeignKey('sensors.id'))
     updatets = Column(DateTime)
+    revision = Column(Integer, nullable=False, default=0, server_default='0')  #: bumped by every insert of points
 
     # Relationships
     sensor = relationship('Sensor', back_populates='no2_graph')
@@ -91,6 +89,7 @@ class H2SGraph(Base):
     id = Column(Integer, primary_key=True)
     sensor_id = Column(ForeignKey('sensors.id'))
     updatets = Column(DateTime)
+    revision = Column(Integer, nullable=False, default=0, server_default='0')  #: bumped by every insert of points
 
     # Relationships
     sensor = relationship('Sensor', back_populates='h2s_graph')
@@ -106,6 +105,7 @@ class SO2Graph(Base):
     id = Column(Integer, primary_key=True)
     sensor_id = Column(ForeignKey('sensors.id'))
     updatets = Column(DateTime)
+    revision = Column(Integer, nullable=False, default=0, server_default='0')  #: bumped by every insert of points
 
     # Relationships
     sensor = relationship('Sensor', back_populates='so2_graph')
@@ -121,16 +121,34 @@ class TemperatureGraph(Base):
     id = Column(Integer, primary_key=True)
     sensor_id = Column(ForeignKey('sensors.id'))
     updatets = Column(DateTime)
+    revision = Column(Integer, nullable=False, default=0, server_default='0')  #: bumped by every insert of points
 
     # Relationships
     sensor = relationship('Sensor', back_populates='temperature_graph')
     points = relationship('TemperaturePoint', back_populates='temperature_graph')
 
+class HumidityGraph(Base):
+    """
+    SQLAlchemy Humidity Graph DB Model
+    """
+    __tablename__ = 'humidity_graphs'
+
+    # Columns
+    id = Column(Integer, primary_key=True)
+    sensor_id = Column(ForeignKey('sensors.id'))
+    updatets = Column(DateTime)
+    revision = Column(Integer, nullable=False, default=0, server_default='0')  #: bumped by every insert of points
+
+    # Relationships
+    sensor = relationship('Sensor', back_populates='humidity_graph')
+    points = relationship('HumidityPoint', back_populates='humidity_graph')
+
 class OzonePoint(Base):
     """
     SQLAlchemy Ozone Point DB Model
     """
     __tablename__ = 'ozone_points'
+    __table_args__ = (Index('uq_ozone_points_graph_time', 'ozone_graph_id', 'time', unique=True),)
 
     # Columns
     id = Column(Integer, primary_key=True)
@@ -147,6 +165,7 @@ class NO2Point(Base):
     SQLAlchemy NO2 Point DB Model
     """
     __tablename__ = 'no2_points'
+    __table_args__ = (Index('uq_no2_points_graph_time', 'no2_graph_id', 'time', unique=True),)
 
     # Columns
     id = Column(Integer, primary_key=True)
@@ -163,6 +182,7 @@ class H2SPoint(Base):
     SQLAlchemy H2S Point DB Model
     """
     __tablename__ = 'h2s_points'
+    __table_args__ = (Index('uq_h2s_points_graph_time', 'h2s_graph_id', 'time', unique=True),)
 
     # Columns
     id = Column(Integer, primary_key=True)
@@ -179,6 +199,7 @@ class SO2Point(Base):
     SQLAlchemy SO2 Point DB Model
     """
     __tablename__ = 'so2_points'
+    __table_args__ = (Index('uq_so2_points_graph_time', 'so2_graph_id', 'time', unique=True),)
 
     # Columns
     id = Column(Integer, primary_key=True)
@@ -195,6 +216,7 @@ class TemperaturePoint(Base):
     SQLAlchemy Temperature Point DB Model
     """
     __tablename__ = 'temperature_points'
+    __table_args__ = (Index('uq_temperature_points_graph_time', 'temperature_graph_id', 'time', unique=True),)
 
     # Columns
     id = Column(Integer, primary_key=True)
@@ -205,29 +227,184 @@ class TemperaturePoint(Base):
     # Relationships
     temperature_graph = relationship('TemperatureGraph', back_populates='points')
 
+class HumidityPoint(Base):
+    """
+    SQLAlchemy Humidity Point DB Model
+    """
+    __tablename__ = 'humidity_points'
+    __table_args__ = (Index('uq_humidity_points_graph_time', 'humidity_graph_id', 'time', unique=True),)
+
+    # Columns
+    id = Column(Integer, primary_key=True)
+    humidity_graph_id = Column(ForeignKey('humidity_graphs.id'))
+    time = Column(DateTime)  #: generic python datetime object
+    humidity = Column(Float)  #: relative humidity, percent
+
+    # Relationships
+    humidity_graph = relationship('HumidityGraph', back_populates='points')
+
+class HourlyRollup(Base):
+    """
+    SQLAlchemy Hourly Rollup DB Model
+    """
+    __tablename__ = 'hourly_rollups'
+
+    # Columns
+    sensor_id = Column(ForeignKey('sensors.id'), primary_key=True)
+    gas = Column(String(8), primary_key=True)  #: key of the gas in GASES
+    time = Column(DateTime, primary_key=True)  #: start of the hour
+    count = Column(Integer)  #: number of points in the hour
+    mean = Column(Float)  #: ppb
+    std = Column(Float)  #: population standard deviation of the points
+    min = Column(Float)
+    max = Column(Float)
+
+class DailyRollup(Base):
+    """
+    SQLAlchemy Daily Rollup DB Model
+    """
+    __tablename__ = 'daily_rollups'
+
+    # Columns
+    sensor_id = Column(ForeignKey('sensors.id'), primary_key=True)
+    gas = Column(String(8), primary_key=True)  #: key of the gas in GASES
+    time = Column(DateTime, primary_key=True)  #: start of the day
+    count = Column(Integer)  #: number of points in the day
+    mean = Column(Float)  #: ppb
+    std = Column(Float)  #: population standard deviation of the points
+    min = Column(Float)
+    max = Column(Float)
+
+class LatestReading(Base):
+    """
+    SQLAlchemy Latest Reading DB Model, one row per sensor kept current by ingest
+    """
+    __tablename__ = 'latest_readings'
+
+    # Columns
+    sensor_id = Column(ForeignKey('sensors.id'), primary_key=True)
+    time = Column(DateTime)  #: time of the most recent point of any series
+    o3 = Column(Float)  #: ppb
+    no2 = Column(Float)  #: ppb
+    h2s = Column(Float)  #: ppb
+    so2 = Column(Float)  #: ppb
+    temperature = Column(Float)
+    humidity = Column(Float)
+
+class SensorRefresh(Base):
+    """
+    SQLAlchemy Sensor Refresh DB Model, when each sensor was last pulled from DynamoDB by any process
+    """
+    __tablename__ = 'sensor_refreshes'
+
+    # Columns
+    sensor_id = Column(ForeignKey('sensors.id'), primary_key=True)
+    time = Column(DateTime)  #: end of the last successful refresh
+
+
+# Per-gas description: ORM models, relationship and foreign key names,
+# DynamoDB attribute prefix, the sensor calibration columns and display label
+GasSeries = namedtuple('GasSeries', ['key', 'graph', 'point', 'relationship', 'foreign_key', 'field', 'm', 'z', 'label'])
+
+GASES = (
+    GasSeries('o3', OzoneGraph, OzonePoint, 'ozone_graph', 'ozone_graph_id', 'O3', 'm_o3', 'z_o3', 'Ozone'),
+    GasSeries('no2', NO2Graph, NO2Point, 'no2_graph', 'no2_graph_id', 'NO2', 'm_no2', 'z_no2', 'NO2'),
+    GasSeries('h2s', H2SGraph, H2SPoint, 'h2s_graph', 'h2s_graph_id', 'H2S', 'm_h2s', 'z_h2s', 'H2S'),
+    GasSeries('so2', SO2Graph, SO2Point, 'so2_graph', 'so2_graph_id', 'SO2', 'm_so2', 'z_so2', 'SO2'),
+)
+
+# Per-climate-series description: ORM models, relationship and foreign key names,
+# the DynamoDB attributes averaged into each point, the value column, display label and unit
+ClimateSeries = namedtuple('ClimateSeries', ['key', 'graph', 'point', 'relationship', 'foreign_key', 'fields', 'column',
+                                             'label', 'unit'])
+
+CLIMATE = (
+    ClimateSeries('temperature', TemperatureGraph, TemperaturePoint, 'temperature_graph', 'temperature_graph_id',
+                  ('temp1', 'temp2', 'temp3'), 'temperature', 'Temperature', 'F'),
+    ClimateSeries('humidity', HumidityGraph, HumidityPoint, 'humidity_graph', 'humidity_graph_id',
+                  ('hum1', 'hum2', 'hum3'), 'humidity', 'Humidity', '%'),
+)
+
 
 def get_all_sensors():
     """
     Get all persisted sensors.
     """
-    Session = app.get_persistent_store_database('sensor_db', as_sessionmaker=True)
-    session = Session()
+    # Request-scoped session, closed when the request finishes
+    session = get_session()
 
     # Query for all sensor records
     sensors = session.query(Sensor).all()
 
-
-    #session.commit()
-    #session.close()
-
     return sensors
 
+def migrate_sensor_db(engine):
+    """
+    Bring tables created by an older version of the app up to date.
+    """
+    from .partitions import ensure_partitions, partitioned_tables, partition_point_tables
+
+    inspector = inspect(engine)
+
+    # Graph tables created before their revision counter
+    for series in GASES + CLIMATE:
+        table = series.graph.__table__
+        if 'revision' not in [column['name'] for column in inspector.get_columns(table.name)]:
+            engine.execute(text('ALTER TABLE {0} ADD COLUMN revision INTEGER NOT NULL DEFAULT 0'.format(table.name)))
+
+    # Collapse duplicate points of the same graph and time before their unique indexes are built
+    partitioned = partitioned_tables(engine)
+    deduplicated = False
+    for series in GASES + CLIMATE:
+        table = series.point.__table__
+        if table.name in partitioned:
+            continue
+        names = [index['name'] for index in inspector.get_indexes(table.name)]
+        if 'uq_{0}_graph_time'.format(table.name) in names:
+            continue
+
+        keep = select([func.min(table.c.id)]).group_by(table.c[series.foreign_key], table.c.time)
+        result = engine.execute(table.delete().where(~table.c.id.in_(keep)))
+        deduplicated = deduplicated or result.rowcount > 0
+
+        # The unique index replaces the plain one
+        if 'ix_{0}_graph_time'.format(table.name) in names:
+            engine.execute(text('DROP INDEX ix_{0}_graph_time'.format(table.name)))
+
+    # create_all only creates indexes along with new tables
+    for table in Base.metadata.sorted_tables:
+        if table.name in partitioned:
+            continue
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    # Point tables become monthly range partitioned tables on PostgreSQL
+    partition_point_tables(engine)
+    ensure_partitions(engine)
+
+    # Fill rollup tables added after points were already ingested, and rebuild any that counted duplicates
+    session = sessionmaker(bind=engine)()
+    try:
+        if deduplicated or (not session.query(HourlyRollup).first() and session.query(OzonePoint).first()):
+            from .rollups import rebuild_rollups
+            rebuild_rollups(session)
+            session.commit()
+
+        # Fill the latest reading snapshot likewise
+        if not session.query(LatestReading).first() and session.query(OzonePoint).first():
+            from .latest import rebuild_latest_readings
+            rebuild_latest_readings(session)
+            session.commit()
+    finally:
+        session.close()
+
 def init_sensor_db(engine, first_time):
     """
     Initializer for the primary database.
     """
     # Create all the tables
     Base.metadata.create_all(engine)
+    migrate_sensor_db(engine)
 
     # Add data
     if first_time:
@@ -237,133 +414,41 @@ def init_sensor_db(engine, first_time):
 
         df_loc = pd.read_csv(loc_file)
         df_loc = df_loc[['id', 'Location:Latitude', 'Location:Longitude']].dropna()
-        df_loc = df_loc.set_index('id', drop=False).drop_duplicates()
-
-        df_cal = pd.read_csv(cal_file, index_col = 0, header = [0,1])  
-
-        for index, row in df_loc.iterrows():
-            id = int(row['id'])
-            sensor = Sensor(
-                id = id,
-                latitude = row['Location:Latitude'],
-                longitude = row['Location:Longitude'],
-                m_o3 = float(df_cal.loc[id,'O3_avg']['m']),
-                m_no2 = float(df_cal.loc[id,'NO2_avg']['m']),
-                m_h2s = float(1),
-                m_so2 = float(df_cal.loc[id,'SO2_avg']['m']),
-                z_o3 = float(df_cal.loc[id,'O3_avg']['zero']),
-                z_no2 = float(df_cal.loc[id,'NO2_avg']['zero']),
-                z_h2s = float(0),
-                z_so2 = float(df_cal.loc[id,'SO2_avg']['zero'])
-            )
-            session.add(sensor)
-
-        # Add the sensors to the session, commit, and close
-        session.commit()
-        session.close()
-        for index, row in df_loc.iterrows():
-            update_sensor(int(row['id']))
-
-def update_sensor(sensor_id):
-    """
-    Update the graph data of a particular sensor
-    """
-
-    try:
-
-        Session = app.get_persistent_store_database('sensor_db', as_sessionmaker=True)
-        session = Session()
-
-        # Get sensor object
-        sensor = session.query(Sensor).get(int(sensor_id))
-
-        ozone_graph = sensor.ozone_graph
-        no2_graph = sensor.no2_graph
-        h2s_graph = sensor.h2s_graph
-        so2_graph = sensor.so2_graph
-
-        # Create graphs if none exist
-        if not ozone_graph:
-            ozone_graph = OzoneGraph(id = int(sensor_id), updatets = datetime(2017, 1, 1), sensor=sensor)
-            sensor.ozone_graph = ozone_graph
-        if not no2_graph:
-            no2_graph = NO2Graph(id = int(sensor_id), updatets = datetime(2017, 1, 1), sensor=sensor)
-            sensor.no2_graph = no2_graph
-        if not h2s_graph:
-            h2s_graph = H2SGraph(id = int(sensor_id), updatets = datetime(2017, 1, 1), sensor=sensor)
-            sensor.h2s_graph = h2s_graph
-        if not so2_graph:
-            so2_graph = SO2Graph(id = int(sensor_id), updatets = datetime(2017, 1, 1), sensor=sensor)
-            sensor.so2_graph = so2_graph
-
-
-        ozone_points = ozone_graph.points
-        no2_points = no2_graph.points
-        so2_points = so2_graph.points
-        h2s_points = h2s_graph.points
-
-
-        df = pull_db(sensor_id, 30, datetime2str(ozone_graph.updatets))
-        
-        ozone_newtimes = []
-        no2_newtimes = []
-        h2s_newtimes = []
-        so2_newtimes = []
-
-        for index, row in df.iterrows():
-            time = str2datetime(str(row["timest"][0]))
-            if time > ozone_graph.updatets:
-                try:
-                    ozone_points.append(OzonePoint(time=time,
-                                                   ppb = (float(row["O3_avg"][0]) + sensor.z_o3)/sensor.m_o3,
-                                                   std = float(row["O3_std"][0])/sensor.m_o3, ozone_graph=ozone_graph))
-                    ozone_newtimes.append(time)
-                except ValueError:
-                    print('Invalid O3 point')
-            if time > no2_graph.updatets:
-                try:
-                    no2_points.append(NO2Point(time=time,
-                                               ppb = (float(row["NO2_avg"][0]) + sensor.z_no2)/sensor.m_no2,
-                                               std = float(row["NO2_std"][0])/sensor.m_no2,
-                                               no2_graph=no2_graph))
-                    no2_newtimes.append(time)
-                except ValueError:
-                    print('Invalid NO2 point')
-            if time > h2s_graph.updatets:
-                try:
-                    h2s_points.append(H2SPoint(time=time,
-                                               ppb = (float(row["H2S_avg"][0]) + sensor.z_h2s)/sensor.m_h2s,
-                                               std = float(row["H2S_std"][0])/sensor.m_h2s,
-                                               h2s_graph=h2s_graph))
-                    h2s_newtimes.append(time)
-                except ValueError:
-                    print('Invalid H2S point')
-            if time > so2_graph.updatets:
-                try:
-                    so2_points.append(SO2Point(time=time,
-                                               ppb = (float(row["SO2_avg"][0]) + sensor.z_so2)/sensor.m_so2,
-                                               std = float(row["SO2_std"][0])/sensor.m_so2,
-                                               so2_graph=so2_graph))
-                    so2_newtimes.append(time)
-                except ValueError:
-                    print('Invalid SO2 point')
-
-        if len(ozone_newtimes) != 0:
-            ozone_graph.updatets = max(ozone_newtimes)
-        if len(no2_newtimes) != 0:
-            no2_graph.updatets = max(no2_newtimes)
-        if len(h2s_newtimes) != 0:
-            h2s_graph.updatets = max(h2s_newtimes)
-        if len(so2_newtimes) != 0:
-            so2_graph.updatets = max(so2_newtimes)
-
-
-        # Wrap up db session
+        df_loc = df_loc.drop_duplicates('id').set_index('id')
+
+        # Flatten (gas, zero/m) calibration columns to sensor column names
+        df_cal = pd.read_csv(cal_file, index_col = 0, header = [0,1])
+        columns = {}
+        for gas in GASES:
+            if (gas.field + '_avg', 'm') in df_cal.columns:
+                columns[gas.m] = df_cal[(gas.field + '_avg', 'm')]
+                columns[gas.z] = df_cal[(gas.field + '_avg', 'zero')]
+        df_cal = pd.DataFrame(columns, index=df_cal.index.astype(int))
+
+        # One join, sensors without coefficients for a gas read raw values
+        df = df_loc.join(df_cal, how='left')
+        for gas in GASES:
+            if gas.m not in df:
+                df[gas.m] = np.nan
+                df[gas.z] = np.nan
+            df[gas.m] = df[gas.m].fillna(1.0)
+            df[gas.z] = df[gas.z].fillna(0.0)
+
+        sensors = [
+            dict(id=int(id), latitude=float(row['Location:Latitude']), longitude=float(row['Location:Longitude']),
+                 **{column: float(row[column]) for gas in GASES for column in (gas.m, gas.z)})
+            for id, row in df.iterrows()
+        ]
+
+        # Add all sensors in one statement, commit, and close
+        session.execute(Sensor.__table__.insert(), sensors)
         session.commit()
         session.close()
 
-    except Exception as e:
-        print(e)
-        return False
+        # Bulk inserts bypass the ORM events that refresh the map layer
+        from .layers import sensor_layer_cache
+        sensor_layer_cache.clear()
 
-    return True
+        # Backfill every sensor concurrently
+        from .ingest import update_all_sensors
+        update_all_sensors(Session)
@@ -14,6 +14,79 @@ $(function()
     // Add the popup overlay to the map
     map.addOverlay(popup);
 
+    // Ozone (ppb) upper bounds of each marker color, after the EPA 8-hour AQI breakpoints
+    var ozone_levels = [
+        [54, '#00e400'],
+        [70, '#ffff00'],
+        [85, '#ff7e00'],
+        [105, '#ff0000'],
+        [Infinity, '#8f3f97']
+    ];
+
+    // Color each sensor marker by its latest ozone reading, grey without one
+    var marker_style = function(feature)
+    {
+        var latest = feature.get('latest') || {};
+        var color = '#999999';
+
+        if (latest.o3 !== undefined && latest.o3 !== null)
+        {
+            for (var i = 0; i < ozone_levels.length; i++)
+            {
+                if (latest.o3 <= ozone_levels[i][0])
+                {
+                    color = ozone_levels[i][1];
+                    break;
+                }
+            }
+        }
+
+        return new ol.style.Style({
+            image: new ol.style.Circle({
+                radius: 8,
+                fill: new ol.style.Fill({color: color}),
+                stroke: new ol.style.Stroke({color: '#ffffff', width: 1})
+            })
+        });
+    };
+
+    // The sensors layer is the vector layer added by the MapView
+    var sensors_layer = null;
+    map.getLayers().forEach(function(layer)
+    {
+        if (layer instanceof ol.layer.Vector)
+        {
+            sensors_layer = layer;
+        }
+    });
+
+    // Refresh the latest readings of every marker from the fleet snapshot
+    var refresh_markers = function()
+    {
+        $.getJSON('/apps/open-air/api/fleet/', function(data)
+        {
+            var features = {};
+            sensors_layer.getSource().getFeatures().forEach(function(feature)
+            {
+                features[feature.get('id')] = feature;
+            });
+
+            data.sensors.forEach(function(sensor)
+            {
+                if (features[sensor.id])
+                {
+                    features[sensor.id].set('latest', sensor.latest);
+                }
+            });
+        });
+    };
+
+    if (sensors_layer)
+    {
+        sensors_layer.setStyle(marker_style);
+        setInterval(refresh_markers, 60000);
+    }
+
     // When selected, call function to display properties
     select_interaction.getFeatures().on('change:length', function(e)
     {
@@ -27,6 +100,27 @@ $(function()
             // Get coordinates of the point to set position of the popup
             var coordinates = selected_feature.getGeometry().getCoordinates();
 
+            // Latest readings carried by the sensor layer, no extra request needed
+            var latest = selected_feature.get('latest') || {};
+            var latest_rows = '';
+            [['o3', 'Ozone'], ['no2', 'NO2'], ['h2s', 'H2S'], ['so2', 'SO2']].forEach(function(gas)
+            {
+                if (latest[gas[0]] !== undefined && latest[gas[0]] !== null)
+                {
+                    latest_rows += '<tr>' +
+                            '<th>' + gas[1] + ':</th>' +
+                            '<td>' + latest[gas[0]].toFixed(1) + ' ppb</td>' +
+                        '</tr>';
+                }
+            });
+            if (latest.time)
+            {
+                latest_rows += '<tr>' +
+                        '<th>As of:</th>' +
+                        '<td>' + latest.time.replace('T', ' ') + '</td>' +
+                    '</tr>';
+            }
+
             // Load graphs dynamically with AJAX
             $.ajax({
                 url: '/apps/open-air/graphs/' + selected_feature.get('id') + '/ajax/',
@@ -47,6 +141,7 @@ $(function()
                                 '<th>Longitude:</th>' +
                                 '<td>' + selected_feature.get('longitude') + '</td>' +
                             '</tr>' +
+                            latest_rows +
                         '</table>' +
                         plot_html +
                     '</div>';
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import literal, select, union_all
+
+from .model import GASES
+from .rollups import RAW, choose_resolution
+
+# Default window of data shown, relative to each graph's last update
+WINDOW = timedelta(days=7)
+
+
+def to_columns(rows, width=3):
+    """
+    Convert (time, value, ...) rows of width columns into a datetime64 time array followed by float arrays.
+    """
+    if not rows:
+        return (np.array([], dtype='datetime64[s]'),) + tuple(np.array([]) for _ in range(width - 1))
+    columns = list(zip(*rows))
+    return (np.array(columns[0], dtype='datetime64[s]'),) \
+        + tuple(np.array(column, dtype=np.float64) for column in columns[1:])
+
+
+def series_query(gas, sensor_id, graph_id, start, end=None, resolution=RAW):
+    """
+    Select (time, ppb, std) of one sensor and gas between start and end at a resolution.
+    """
+    if resolution.model is None:
+        point = gas.point
+        query = select([point.time, point.ppb, point.std]) \
+            .where(getattr(point, gas.foreign_key) == graph_id)
+        time_column = point.time
+    else:
+        rollup = resolution.model
+        query = select([rollup.time, rollup.mean.label('ppb'), rollup.std]) \
+            .where(rollup.sensor_id == sensor_id) \
+            .where(rollup.gas == gas.key)
+        time_column = rollup.time
+
+    query = query.where(time_column >= start)
+    if end is not None:
+        query = query.where(time_column <= end)
+    return query, time_column
+
+
+def query_climate_points(session, series, graph, window=WINDOW):
+    """
+    Get the time and value columns of a temperature or humidity graph within window of its last update.
+    """
+    point = series.point
+    query = select([point.time, getattr(point, series.column)]) \
+        .where(getattr(point, series.foreign_key) == graph.id) \
+        .where(point.time >= graph.updatets - window) \
+        .order_by(point.time)
+    return to_columns(session.execute(query).fetchall(), width=2)
+
+
+def query_graphs(session, sensor_ids=None, gases=GASES):
+    """
+    Get (gas key, graph id, sensor id, updatets, revision) of the graphs of some (or all) sensors.
+
+    One UNION ALL over the graph tables.
+    """
+    branches = []
+    for gas in gases:
+        branch = select([literal(gas.key).label('gas'), gas.graph.id, gas.graph.sensor_id, gas.graph.updatets,
+                         gas.graph.revision])
+        if sensor_ids is not None:
+            branch = branch.where(gas.graph.sensor_id.in_([int(sensor_id) for sensor_id in sensor_ids]))
+        branches.append(branch)
+    return session.execute(union_all(*branches)).fetchall()
+
+
+def default_resolution(graph_rows, window=WINDOW, start=None, end=None):
+    """
+    Finest resolution that keeps the span requested of the given graphs within MAX_SCAN_POINTS.
+    """
+    span = (end or max(row[3] for row in graph_rows)) - start if start is not None else window
+    return choose_resolution(span)
+
+
+def query_points(session, graph_rows, window=WINDOW, start=None, end=None, gases=GASES, resolution=None):
+    """
+    Get the time, ppb and std columns of the given graphs keyed by (sensor id, gas key).
+
+    Points are taken from start (default: window before each graph's updatets) up to end,
+    from the raw points or a rollup table, by default the finest resolution that keeps
+    the requested span within MAX_SCAN_POINTS.
+    Runs one UNION ALL over the point or rollup tables, each branch an index range scan.
+    """
+    if not graph_rows:
+        return OrderedDict()
+
+    resolution = resolution or default_resolution(graph_rows, window, start, end)
+
+    by_key = {gas.key: gas for gas in gases}
+    branches = []
+    for key, graph_id, sensor_id, updatets, revision in graph_rows:
+        query, time_column = series_query(by_key[key], sensor_id, graph_id,
+                                          start if start is not None else updatets - window, end, resolution)
+        branches.append(query.column(literal(key).label('gas')).column(literal(sensor_id).label('sensor_id')))
+    rows = session.execute(union_all(*branches).order_by('sensor_id', 'gas', 'time')).fetchall()
+
+    # Split the combined rows back into per-series columns, sensors ascending and gases in GASES order
+    order = dict((gas.key, i) for i, gas in enumerate(gases))
+    keys = sorted(set((row[2], row[0]) for row in graph_rows), key=lambda k: (k[0], order[k[1]]))
+    series = OrderedDict((key, []) for key in keys)
+    for time, ppb, std, key, sensor_id in rows:
+        series[(sensor_id, key)].append((time, ppb, std))
+
+    return OrderedDict((key, to_columns(rows)) for key, rows in series.items())
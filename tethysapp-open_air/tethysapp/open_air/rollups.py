@@ -0,0 +1,108 @@
+from collections import namedtuple, OrderedDict
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from .model import HourlyRollup, DailyRollup, GASES
+
+# Resolutions graphs can be drawn from, finest first, with the spacing of their points
+Resolution = namedtuple('Resolution', ['name', 'model', 'step', 'freq'])
+
+RAW = Resolution('raw', None, timedelta(minutes=15), None)
+RESOLUTIONS = OrderedDict((resolution.name, resolution) for resolution in (
+    RAW,
+    Resolution('hourly', HourlyRollup, timedelta(hours=1), '60min'),
+    Resolution('daily', DailyRollup, timedelta(days=1), '1D'),
+))
+
+# Most points a graph query should scan before switching to a coarser resolution
+MAX_SCAN_POINTS = 5000
+
+ROLLUP_COLUMNS = ['time', 'count', 'mean', 'std', 'min', 'max']
+
+ONE_DAY = timedelta(days=1)
+
+
+def choose_resolution(window, max_points=MAX_SCAN_POINTS):
+    """
+    Finest resolution whose number of points over window stays within max_points.
+    """
+    for resolution in RESOLUTIONS.values():
+        if window.total_seconds() / resolution.step.total_seconds() <= max_points:
+            return resolution
+    return resolution
+
+
+def aggregate(times, values, freq):
+    """
+    Aggregate points into count, mean, population std, min and max per bucket.
+    """
+    df = pd.DataFrame({'time': pd.DatetimeIndex(times).floor(freq), 'value': values})
+    grouped = df.groupby('time')['value']
+    rollup = grouped.agg(['count', 'mean', 'min', 'max'])
+    rollup['std'] = grouped.std(ddof=0)
+    return rollup.reset_index()[ROLLUP_COLUMNS]
+
+
+def day_ranges(times):
+    """
+    (start, end) of each run of consecutive days holding any of times.
+    """
+    ranges = []
+    for day in pd.DatetimeIndex(times).floor('1D').unique().sort_values():
+        day = day.to_pydatetime()
+        if ranges and ranges[-1][1] == day:
+            ranges[-1] = (ranges[-1][0], day + ONE_DAY)
+        else:
+            ranges.append((day, day + ONE_DAY))
+    return ranges
+
+
+def update_rollups(session, gas, sensor_id, graph_id, times):
+    """
+    Recompute every rollup bucket of one sensor and gas touched by times from the graph's raw points.
+
+    Reading back the raw table counts each point once, even where a concurrent refresh stored some of times
+    first and this one's INSERT skipped them.
+    """
+    point = gas.point
+    graph_column = getattr(point, gas.foreign_key)
+    for start, end in day_ranges(times):
+        rows = session.query(point.time, point.ppb) \
+                      .filter(graph_column == graph_id, point.time >= start, point.time < end, point.ppb.isnot(None)) \
+                      .all()
+        raw_times = [row[0] for row in rows]
+        values = np.array([row[1] for row in rows], dtype=np.float64)
+
+        for resolution in RESOLUTIONS.values():
+            model = resolution.model
+            if model is None:
+                continue
+
+            # Whole days are replaced, so hourly and daily buckets line up with what is read
+            session.query(model).filter(model.sensor_id == int(sensor_id), model.gas == gas.key,
+                                        model.time >= start, model.time < end).delete(synchronize_session=False)
+            if not rows:
+                continue
+            records = [
+                {'sensor_id': int(sensor_id), 'gas': gas.key, 'time': time.to_pydatetime(), 'count': int(count),
+                 'mean': float(mean), 'std': float(std), 'min': float(low), 'max': float(high)}
+                for time, count, mean, std, low, high in aggregate(raw_times, values, resolution.freq).itertuples(
+                    index=False)
+            ]
+            session.execute(model.__table__.insert(), records)
+
+
+def rebuild_rollups(session, gases=GASES):
+    """
+    Recompute the rollups of every day holding raw points, one graph at a time.
+
+    Rollups of days without raw points are kept, they are all that is left of archived months.
+    """
+    for gas in gases:
+        for graph_id, sensor_id in session.query(gas.graph.id, gas.graph.sensor_id).all():
+            times = [row[0] for row in session.query(gas.point.time)
+                                              .filter(getattr(gas.point, gas.foreign_key) == graph_id).all()]
+            if times:
+                update_rollups(session, gas, sensor_id, graph_id, times)
@@ -0,0 +1,138 @@
+import json
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tethys_sdk.testing import TethysTestCase
+
+from .. import api
+from ..ingest import insert_points
+from ..model import Base, GASES, OzoneGraph, NO2Graph, Sensor
+
+OZONE = next(gas for gas in GASES if gas.key == 'o3')
+NO2 = next(gas for gas in GASES if gas.key == 'no2')
+
+
+def columns(times, values):
+    time = np.array(pd.DatetimeIndex(times), dtype='datetime64[s]')
+    values = np.array(values, dtype=np.float64)
+    return time, values, values / 10
+
+
+class ReadingsApiTestCase(TethysTestCase):
+    """
+    The readings API through its URL: login required, NDJSON streamed with ?output=ndjson.
+    """
+
+    def set_up(self):
+        self.c = self.get_test_client()
+        self.user = self.create_test_user(username="joe", password="secret", email="joe@some_site.com")
+        self.url = '/apps/open-air/api/readings/'
+
+    def test_anonymous_rejected(self):
+        with mock.patch.object(api, 'get_series') as get_series:
+            response = self.c.get(self.url)
+        self.assertEqual(response.status_code, 401)
+        get_series.assert_not_called()
+
+    def test_ndjson_streamed(self):
+        self.c.force_login(self.user)
+        series = [
+            ((14, 'o3'), columns(['2018-05-01 12:00', '2018-05-01 12:15'], [10, 11])),
+            ((14, 'no2'), columns(['2018-05-01 12:00'], [3])),
+        ]
+        with mock.patch.object(api, 'iter_series', return_value=iter(series)) as iter_series:
+            response = self.c.get(self.url, {'sensor': '14', 'gas': 'o3,no2', 'output': 'ndjson'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        iter_series.assert_called_once_with([14], ['o3', 'no2'], None, None, None)
+        self.assertEqual([(line['sensor_id'], line['gas']) for line in lines], [(14, 'o3'), (14, 'no2')])
+        self.assertEqual(lines[0]['time'], ['2018-05-01T12:00:00', '2018-05-01T12:15:00'])
+        self.assertEqual(lines[0]['ppb'], [10, 11])
+
+    def test_json_by_default(self):
+        self.c.force_login(self.user)
+        series = {(14, 'o3'): columns(['2018-05-01 12:00'], [10])}
+        with mock.patch.object(api, 'get_series', return_value=series):
+            response = self.c.get(self.url, {'sensor': '14'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['series'][0]['ppb'], [10])
+
+
+class FleetApiTestCase(TethysTestCase):
+    """
+    The fleet state API requires a logged in user.
+    """
+
+    def set_up(self):
+        self.c = self.get_test_client()
+        self.user = self.create_test_user(username="joe", password="secret", email="joe@some_site.com")
+        self.url = '/apps/open-air/api/fleet/'
+
+    def test_anonymous_rejected(self):
+        with mock.patch.object(api, 'query_fleet_state') as query_fleet_state:
+            response = self.c.get(self.url)
+        self.assertEqual(response.status_code, 401)
+        query_fleet_state.assert_not_called()
+
+    def test_fleet_state(self):
+        self.c.force_login(self.user)
+        sensors = [{'id': 14, 'latitude': 39.3, 'longitude': -76.6, 'latest': {'o3': 30.0}}]
+        with mock.patch.object(api, 'get_session'), \
+                mock.patch.object(api, 'query_fleet_state', return_value=sensors):
+            response = self.c.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'sensors': sensors})
+
+
+class IterSeriesTestCase(unittest.TestCase):
+    """
+    The NDJSON stream queries one graph at a time, in the same order and with the same points as the JSON response.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        session = self.Session()
+        updatets = datetime(2018, 5, 1, 12, 45)
+        for sensor_id in (2, 1):
+            session.add(Sensor(id=sensor_id))
+            session.add(OzoneGraph(id=sensor_id, sensor_id=sensor_id, updatets=updatets))
+            session.add(NO2Graph(id=sensor_id, sensor_id=sensor_id, updatets=updatets))
+        session.flush()
+        times = pd.date_range('2018-05-01 12:00', updatets, freq='15min')
+        for gas in (OZONE, NO2):
+            for graph_id in (1, 2):
+                values = np.arange(len(times), dtype=np.float64) + graph_id
+                insert_points(session, gas.point.__table__, gas.foreign_key, graph_id, times, ppb=values, std=values)
+        session.commit()
+        session.close()
+
+        for name, Session in (('get_session', self.Session), ('get_session_maker', lambda: self.Session)):
+            patcher = mock.patch.object(api, name, Session)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_matches_combined_query_lazily(self):
+        start = datetime(2018, 5, 1, 12, 15)
+        expected = api.get_series(None, None, start, None)
+
+        with mock.patch.object(api, 'query_points', wraps=api.query_points) as query_points:
+            stream = api.iter_series(None, None, start, None)
+            first = next(stream)
+            self.assertEqual(query_points.call_count, 1)
+            streamed = [first] + list(stream)
+
+        self.assertEqual([key for key, _ in streamed], list(expected))
+        self.assertEqual([key for key, _ in streamed], [(1, 'o3'), (1, 'no2'), (2, 'o3'), (2, 'no2')])
+        for (key, got), want in zip(streamed, expected.values()):
+            for got_column, want_column in zip(got, want):
+                np.testing.assert_array_equal(got_column, want_column)
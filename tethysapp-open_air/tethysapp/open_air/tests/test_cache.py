@@ -0,0 +1,50 @@
+import unittest
+import warnings
+from datetime import datetime
+from unittest import mock
+
+from django.core.cache.backends.locmem import LocMemCache
+
+from ..cache import DjangoGraphCache, LRUGraphCache
+
+
+class LRUGraphCacheTestCase(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUGraphCache(max_size=2)
+        cache.set((1, 'o3'), 'a')
+        cache.set((2, 'o3'), 'b')
+        cache.get((1, 'o3'))
+        cache.set((3, 'o3'), 'c')
+        self.assertEqual(cache.get((2, 'o3')), None)
+        self.assertEqual(cache.get((1, 'o3')), 'a')
+
+    def test_invalidate_sensor(self):
+        cache = LRUGraphCache()
+        cache.set((1, 'o3'), 'a')
+        cache.set((2, 'o3'), 'b')
+        cache.invalidate(1)
+        self.assertEqual((cache.get((1, 'o3')), cache.get((2, 'o3'))), (None, 'b'))
+
+
+class DjangoGraphCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = LocMemCache('open_air_tests', {})
+        with mock.patch('django.core.cache.caches', {'default': self.backend}):
+            self.cache = DjangoGraphCache('default', 60)
+        versions = tuple((gas, datetime(2018, 5, 1, 12, 15), 3) for gas in ('h2s', 'no2', 'o3', 'so2'))
+        self.key = (14, 'all', 604800.0, versions, 2000)
+
+    def test_keys_valid_for_memcached(self):
+        key = self.cache._key(self.key)
+        self.assertLessEqual(len(key), 250)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.backend.validate_key(key)
+
+    def test_invalidate_bumps_version(self):
+        self.cache.set(self.key, {'data': []})
+        self.assertEqual(self.cache.get(self.key), {'data': []})
+        self.cache.invalidate(14)
+        self.assertIsNone(self.cache.get(self.key))
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ..callibrate import CLIP, calibrate, write_coefficients
+
+# Sensitivity of each sensor and the drift of its zero (ppb), sensor 3 only ever reads its zero
+SENSITIVITY = {1: 2.5, 2: -0.8, 3: 1.5}
+DRIFT = {1: 25.0, 2: -40.0, 3: 10.0}
+
+
+def reference(times, sensor_id):
+    """
+    True ozone: the same within each hour, 0 ppb in the 6am hour and up to 60 ppb at 6pm.
+    """
+    if sensor_id == 3:
+        return np.zeros(len(times))
+    hour = times.floor('60min').hour
+    return 30 * (1 - np.cos(2 * np.pi * (hour - 6) / 24.0))
+
+
+class CalibrateTestCase(unittest.TestCase):
+    """
+    Raw averages -> calibrate -> (avg + zero) / m as ingest computes it gives back the true ppb.
+    """
+
+    def setUp(self):
+        self.times = pd.date_range('2018-05-01', periods=4 * 24 * 4, freq='15min')
+        # Noise that cancels within each hour
+        noise = np.tile([1.0, -1.0, 1.0, -1.0], len(self.times) // 4)
+
+        frames = []
+        for sensor_id, m in SENSITIVITY.items():
+            ppb = reference(self.times, sensor_id) + DRIFT[sensor_id] + noise
+            frames.append(pd.DataFrame({
+                'id': sensor_id,
+                'timest': self.times.strftime('%Y%m%d%H%M%S').astype(np.int64),
+                'O3_avg': ppb * m,
+            }))
+        self.readings = pd.concat(frames, ignore_index=True)
+
+        # The sensitivity follows the first 28 characters of the QR code
+        self.meta = pd.DataFrame({
+            'qr_ozone': ['050217012308 110401 O3 1705 {0}'.format(m) for m in SENSITIVITY.values()],
+        }, index=pd.Index(list(SENSITIVITY), name='id'))
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_calibrated_matches_reference(self):
+        calibrated, _ = calibrate(self.readings, self.meta, gases=('O3',))
+        cal = calibrated['O3']
+
+        # Sensor 3 never varies, it is dropped
+        self.assertEqual(list(cal.columns), [1, 2])
+        for sensor_id in (1, 2):
+            np.testing.assert_allclose(cal[sensor_id], reference(cal.index, sensor_id), atol=1e-9)
+        self.assertTrue((cal.abs() <= CLIP).all().all())
+
+    def test_zero_cancels_drift(self):
+        _, coefficients = calibrate(self.readings, self.meta, gases=('O3',))
+        for sensor_id in (1, 2):
+            m = SENSITIVITY[sensor_id]
+            self.assertAlmostEqual(coefficients.loc[sensor_id, ('O3_avg', 'm')], m)
+            # The 6am baseline is the drift, zero = -baseline * m
+            self.assertAlmostEqual(coefficients.loc[sensor_id, ('O3_avg', 'zero')], -DRIFT[sensor_id] * m)
+
+    def test_round_trip_through_zeroes_file(self):
+        _, coefficients = calibrate(self.readings, self.meta, gases=('O3',))
+        path = os.path.join(self.directory, 'zeroes.csv')
+        write_coefficients(coefficients, path)
+
+        # Read back like init_sensor_db, then convert the raw points like ingest
+        stored = pd.read_csv(path, index_col=0, header=[0, 1])
+        for sensor_id in (1, 2):
+            m = stored.loc[sensor_id, ('O3_avg', 'm')]
+            zero = stored.loc[sensor_id, ('O3_avg', 'zero')]
+            raw = self.readings[self.readings['id'] == sensor_id]['O3_avg'].to_numpy()
+            ppb = pd.Series((raw + zero) / m, index=self.times).resample('60min').mean()
+            np.testing.assert_allclose(ppb, reference(ppb.index, sensor_id), atol=1e-6)
@@ -0,0 +1,50 @@
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from ..conversion_helpers import datetime2str, datetime642timest, str2datetime, timest2datetime64
+
+
+class TimestCodecTestCase(unittest.TestCase):
+    """
+    YYYYMMDDHHMMSS numbers <-> datetime64 conversion.
+    """
+
+    def test_round_trip(self):
+        timest = np.array([20170101000000, 20180228235959, 20160229120000, 20181231235959, 20180615093015])
+        times = timest2datetime64(timest)
+
+        self.assertEqual(times[0], np.datetime64('2017-01-01T00:00:00'))
+        self.assertEqual(times[2], np.datetime64('2016-02-29T12:00:00'))
+        self.assertEqual(times[4], np.datetime64('2018-06-15T09:30:15'))
+        np.testing.assert_array_equal(datetime642timest(times), timest)
+
+    def test_round_trip_every_minute_of_a_leap_year(self):
+        times = np.arange(np.datetime64('2016-01-01T00:00:00'), np.datetime64('2017-01-01T00:00:00'),
+                          np.timedelta64(7, 'm'))
+        np.testing.assert_array_equal(timest2datetime64(datetime642timest(times)), times)
+
+    def test_invalid_dates_are_nat(self):
+        timest = np.array([
+            20180230120000,  # February 30th
+            20170229000000,  # not a leap year
+            20181301000000,  # month 13
+            20180001000000,  # month 0
+            20180100000000,  # day 0
+            20180101240000,  # hour 24
+            20180101006000,  # minute 60
+            20180101000060,  # second 60
+            -20180101000000,
+        ])
+        self.assertTrue(np.isnat(timest2datetime64(timest)).all())
+
+    def test_nat_encodes_to_zero(self):
+        times = np.array(['2018-05-01T00:00:00', 'NaT'], dtype='datetime64[s]')
+        np.testing.assert_array_equal(datetime642timest(times), [20180501000000, 0])
+
+    def test_strings(self):
+        self.assertEqual(str2datetime('20180501123000'), datetime(2018, 5, 1, 12, 30))
+        self.assertEqual(datetime2str(datetime(2018, 5, 1, 12, 30)), '20180501123000')
+        with self.assertRaises(ValueError):
+            str2datetime('20180231000000')
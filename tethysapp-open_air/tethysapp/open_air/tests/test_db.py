@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from django.core.signals import request_finished
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from .. import db
+
+
+class DbTestCase(unittest.TestCase):
+    """
+    Request-scoped sessions and the pool status of the process-wide engine.
+    """
+
+    def setUp(self):
+        self.saved = (db._engine, db._Session)
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_engine('sqlite:///' + os.path.join(self.directory, 'sensor.db'), poolclass=QueuePool,
+                                    pool_size=db.DB_POOL_SIZE, max_overflow=db.DB_MAX_OVERFLOW)
+        db.use_engine(self.engine)
+
+    def tearDown(self):
+        db.session_registry.remove()
+        db._engine, db._Session = self.saved
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_session_removed_when_request_finishes(self):
+        session = db.get_session()
+        self.assertIs(db.get_session(), session)
+        session.execute(text('SELECT 1'))
+        self.assertEqual(self.engine.pool.checkedout(), 1)
+
+        request_finished.send(sender=self.__class__)
+        self.assertEqual(self.engine.pool.checkedout(), 0)
+        self.assertIsNot(db.get_session(), session)
+
+    def test_session_per_thread(self):
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(db.get_session()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(sessions[0], db.get_session())
+
+    def test_pool_status(self):
+        connection = self.engine.connect()
+        try:
+            status = db.pool_status()
+        finally:
+            connection.close()
+        self.assertEqual(sorted(status), ['checkedin', 'checkedout', 'max_overflow', 'overflow', 'pool', 'size'])
+        self.assertEqual(status['pool'], 'QueuePool')
+        self.assertEqual(status['size'], db.DB_POOL_SIZE)
+        self.assertEqual(status['max_overflow'], db.DB_MAX_OVERFLOW)
+        self.assertEqual(status['checkedout'], 1)
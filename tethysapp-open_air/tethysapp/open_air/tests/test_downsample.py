@@ -0,0 +1,48 @@
+import unittest
+
+import numpy as np
+
+from ..downsample import downsample, minmax_indices
+
+
+class MinMaxDownsampleTestCase(unittest.TestCase):
+    """
+    Min/max bucketing keeps every bucket's extremes and both endpoints within the point budget.
+    """
+
+    def setUp(self):
+        self.y = np.random.RandomState(0).normal(0, 1, 10007)
+
+    def test_short_series_untouched(self):
+        np.testing.assert_array_equal(minmax_indices(self.y[:100], 500), np.arange(100))
+        np.testing.assert_array_equal(minmax_indices(self.y[:100], 0), np.arange(100))
+
+    def test_bounded_and_sorted(self):
+        keep = minmax_indices(self.y, 100)
+        self.assertLessEqual(len(keep), 102)
+        self.assertTrue((np.diff(keep) > 0).all())
+
+    def test_keeps_endpoints_and_extremes(self):
+        keep = set(minmax_indices(self.y, 100))
+        self.assertIn(0, keep)
+        self.assertIn(len(self.y) - 1, keep)
+        self.assertIn(self.y.argmin(), keep)
+        self.assertIn(self.y.argmax(), keep)
+
+    def test_keeps_every_bucket_extreme(self):
+        keep = set(minmax_indices(self.y, 100))
+        size = -(-len(self.y) // 50)
+        for start in range(0, len(self.y), size):
+            bucket = self.y[start:start + size]
+            self.assertIn(start + bucket.argmin(), keep)
+            self.assertIn(start + bucket.argmax(), keep)
+
+    def test_spike_survives(self):
+        y = np.zeros(10000)
+        y[4321] = 100
+        y[8765] = -100
+        x, kept = downsample(np.arange(10000), y, max_points=50)
+        self.assertIn(4321, x)
+        self.assertIn(8765, x)
+        self.assertEqual(kept.max(), 100)
+        self.assertEqual(kept.min(), -100)
@@ -0,0 +1,157 @@
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+
+from .. import dynamo_pull
+from ..dynamo_pull import TokenBucket, decode_items, get_client, pull_db, query_page, reset_client
+
+
+class FakeClock(object):
+    """
+    Stand-in for the time module whose sleeps only advance the clock (by at least a microsecond, like real ones).
+    """
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += max(seconds, 1e-6)
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(dynamo_pull, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=10, burst=3)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+        bucket.acquire()
+        self.assertAlmostEqual(sum(self.clock.sleeps), 0.1, places=4)
+
+        for _ in range(10):
+            bucket.acquire()
+        self.assertAlmostEqual(self.clock.now - 100.0, 1.1, places=4)
+
+    def test_refills_up_to_burst(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.clock.now += 60
+        for _ in range(2):
+            bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+        bucket.acquire()
+        self.assertAlmostEqual(sum(self.clock.sleeps), 0.1, places=4)
+
+    def test_no_rate_never_blocks(self):
+        bucket = TokenBucket(rate=0, burst=0)
+        for _ in range(100):
+            bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_throttled_pages_retried(self):
+        throttled = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'Query')
+        client = mock.Mock()
+        client.query.side_effect = [throttled, throttled, {'Items': []}]
+        with mock.patch.object(dynamo_pull, 'read_limiter', TokenBucket(rate=0, burst=0)):
+            self.assertEqual(query_page(client, TableName='readings'), {'Items': []})
+        self.assertEqual(len(self.clock.sleeps), 2)
+
+        client.query.side_effect = ClientError({'Error': {'Code': 'ValidationException'}}, 'Query')
+        with self.assertRaises(ClientError):
+            query_page(client, TableName='readings')
+
+
+class ClientTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        reset_client()
+
+    def test_one_client_per_process(self):
+        reset_client()
+        with mock.patch.object(dynamo_pull.bt.session, 'Session') as Session:
+            self.assertIs(get_client(), get_client())
+            reset_client()
+            get_client()
+        self.assertEqual(Session.call_count, 2)
+        self.assertEqual(Session.return_value.client.call_args[1]['config'].retries['mode'], 'adaptive')
+
+
+class DecodeItemsTestCase(unittest.TestCase):
+
+    def test_low_level_and_resource_items(self):
+        items = [
+            {'id': {'S': '14'}, 'timest': {'N': '20180501120000'}, 'O3_avg': {'N': '-201.5'}, 'battAV': {'S': '1,2,'}},
+            {'id': '14', 'timest': Decimal('20180501121500'), 'O3_avg': Decimal('7'), 'battAV': '3,4,'},
+            {'id': '14', 'timest': Decimal('20180501123000'), 'O3_avg': 'nan?'},
+        ]
+        df = decode_items(items, ['id', 'timest', 'O3_avg', 'temp1', 'battAV'])
+
+        self.assertEqual(list(df.columns), ['id', 'timest', 'O3_avg', 'temp1', 'battAV'])
+        self.assertEqual(df['id'].dtype, np.int64)
+        np.testing.assert_array_equal(df['timest'], [20180501120000, 20180501121500, 20180501123000])
+        np.testing.assert_array_equal(df['O3_avg'], [-201.5, 7, np.nan])
+        self.assertTrue(df['temp1'].isnull().all())
+        self.assertEqual(list(df['battAV'][:2]), ['1,2,', '3,4,'])
+        self.assertTrue(pd.isnull(df['battAV'][2]))
+
+    def test_empty(self):
+        df = decode_items([], ['timest', 'O3_avg'])
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), ['timest', 'O3_avg'])
+
+
+class PullTestCase(unittest.TestCase):
+
+    def test_follows_every_page(self):
+        client = mock.Mock()
+        client.query.side_effect = [
+            {'Items': [{'timest': {'N': '20180501120000'}}], 'LastEvaluatedKey': {'timest': {'N': '20180501120000'}}},
+            {'Items': [{'timest': {'N': '20180501121500'}}]},
+        ]
+        with mock.patch.object(dynamo_pull, 'get_client', return_value=client):
+            df = pull_db(14, 30, '20180501000000', ['timest'])
+
+        np.testing.assert_array_equal(df['timest'], [20180501120000, 20180501121500])
+        self.assertEqual(client.query.call_args_list[1][1]['ExclusiveStartKey'], {'timest': {'N': '20180501120000'}})
+
+    def test_projection(self):
+        self.assertEqual(dynamo_pull.projection(['timest', 'O3_avg']),
+                         ('#f0, #f1', {'#f0': 'timest', '#f1': 'O3_avg'}))
+
+    def test_reads_only_requested_fields(self):
+        client = mock.Mock()
+        client.query.return_value = {'Items': [{'timest': {'N': '20180501120000'}, 'O3_avg': {'N': '12.5'}}]}
+        with mock.patch.object(dynamo_pull, 'get_client', return_value=client):
+            df = pull_db(14, 30, '20180501000000', ['timest', 'O3_avg'])
+
+        kwargs = client.query.call_args[1]
+        self.assertEqual(kwargs['ProjectionExpression'], '#f0, #f1')
+        self.assertEqual(kwargs['ExpressionAttributeNames'],
+                         {'#f0': 'timest', '#f1': 'O3_avg', '#id': 'id', '#timest': 'timest'})
+        self.assertEqual(list(df.columns), ['timest', 'O3_avg'])
+        self.assertEqual(df['O3_avg'][0], 12.5)
+
+    def test_end_bound(self):
+        client = mock.Mock()
+        client.query.return_value = {'Items': []}
+        with mock.patch.object(dynamo_pull, 'get_client', return_value=client):
+            pull_db(14, 30, '20161231230000', ['timest'], end='20180501230000')
+
+        kwargs = client.query.call_args[1]
+        self.assertEqual(kwargs['KeyConditionExpression'], '#id = :id AND #timest BETWEEN :cutoff AND :end')
+        self.assertEqual(kwargs['ExpressionAttributeValues'][':end'], {'N': '20180501230000'})
@@ -0,0 +1,65 @@
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ..export import COLUMNS, iter_csv, iter_reading_chunks
+from ..ingest import insert_points
+from ..model import Base, GASES, NO2Graph, OzoneGraph, Sensor
+
+OZONE = next(gas for gas in GASES if gas.key == 'o3')
+NO2 = next(gas for gas in GASES if gas.key == 'no2')
+
+
+class ExportTestCase(unittest.TestCase):
+    """
+    Chunks of an export cover the range once, points on chunk boundaries included.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add(Sensor(id=14))
+        self.session.add(OzoneGraph(id=1, sensor_id=14, updatets=datetime(2018, 5, 1, 14)))
+        self.session.add(NO2Graph(id=1, sensor_id=14, updatets=datetime(2018, 5, 1, 14)))
+        self.session.flush()
+
+        # Every chunk boundary (12:00, 13:00, 14:00) holds a point
+        self.times = pd.date_range('2018-05-01 11:00', '2018-05-01 15:00', freq='15min')
+        for gas in (OZONE, NO2):
+            values = np.arange(len(self.times), dtype=np.float64)
+            insert_points(self.session, gas.point.__table__, gas.foreign_key, 1, self.times, ppb=values, std=values)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def chunks(self, **kwargs):
+        return list(iter_reading_chunks(self.session, start=datetime(2018, 5, 1, 12), end=datetime(2018, 5, 1, 14),
+                                        chunk=timedelta(hours=1), **kwargs))
+
+    def test_chunk_boundaries(self):
+        chunks = self.chunks()
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue((chunks[0]['time'] < datetime(2018, 5, 1, 13)).all())
+        self.assertTrue((chunks[1]['time'] >= datetime(2018, 5, 1, 13)).all())
+
+        df = pd.concat(chunks, ignore_index=True)
+        self.assertFalse(df.duplicated(['sensor_id', 'gas', 'time']).any())
+        expected = [time for time in self.times if datetime(2018, 5, 1, 12) <= time <= datetime(2018, 5, 1, 14)]
+        for gas in ('o3', 'no2'):
+            self.assertEqual(sorted(df.loc[df['gas'] == gas, 'time']), expected)
+
+    def test_csv_header_once(self):
+        lines = ''.join(iter_csv(iter(self.chunks(gases=['o3'])))).splitlines()
+        self.assertEqual(lines[0], ','.join(COLUMNS))
+        self.assertEqual(lines.count(lines[0]), 1)
+        self.assertEqual(lines[1], '14,o3,2018-05-01T12:00:00,4.0,4.0')
+        self.assertEqual(len(lines), 1 + 9)
+
+    def test_csv_header_without_readings(self):
+        self.assertEqual(''.join(iter_csv(iter([]))), ','.join(COLUMNS) + '\n')
@@ -0,0 +1,230 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from .. import ingest
+from ..conversion_helpers import datetime2str
+from ..dynamo_pull import decode_items
+from ..ingest import EPOCH, INGEST_FIELDS, INGEST_OVERLAP, get_backfill, get_cutoff, get_graphs, insert_points, \
+    select_new, write_points
+from ..model import Base, GASES, H2SGraph, OzoneGraph, OzonePoint, Sensor, TemperaturePoint
+
+OZONE = next(gas for gas in GASES if gas.key == 'o3')
+
+
+def add_sensors(Session, sensor_ids):
+    session = Session()
+    for sensor_id in sensor_ids:
+        sensor = Sensor(id=sensor_id)
+        for gas in GASES:
+            setattr(sensor, gas.m, 1.0)
+            setattr(sensor, gas.z, 0.0)
+        session.add(sensor)
+    session.commit()
+    session.close()
+
+
+class FleetRefreshPoolTestCase(unittest.TestCase):
+    """
+    A fleet refresh with many pull workers fits in a two connection pool.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_engine('sqlite:///' + os.path.join(self.directory, 'sensor.db'), poolclass=QueuePool,
+                                    pool_size=2, max_overflow=0, pool_timeout=1)
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        add_sensors(self.Session, range(1, 7))
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_pull_workers_hold_no_connections(self):
+        checked_out = []
+
+        def pull_db(sensor_id, days, cutoff, fields):
+            checked_out.append(self.engine.pool.checkedout())
+            return decode_items([], fields)
+
+        with mock.patch.object(ingest, 'pull_db', side_effect=pull_db):
+            results = ingest.update_all_sensors(self.Session, max_workers=16)
+
+        self.assertEqual(sorted(results), list(range(1, 7)))
+        self.assertTrue(all(result.success for result in results.values()))
+        self.assertLessEqual(max(checked_out), 2)
+
+
+class SelectNewTestCase(unittest.TestCase):
+    """
+    Re-pulled overlap windows only insert points a graph does not store yet.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add(Sensor(id=1))
+        self.graph = OzoneGraph(id=1, sensor_id=1, updatets=datetime(2018, 5, 1, 12))
+        self.session.add(self.graph)
+        self.session.flush()
+
+        self.stored = pd.date_range('2018-05-01 10:00', '2018-05-01 12:00', freq='15min')
+        self.insert(self.stored)
+
+    def tearDown(self):
+        self.session.close()
+
+    def insert(self, times):
+        values = np.arange(len(times), dtype=np.float64)
+        insert_points(self.session, OzonePoint.__table__, OZONE.foreign_key, self.graph.id, times,
+                      ppb=values, std=values)
+
+    def stored_times(self):
+        return [row[0] for row in self.session.query(OzonePoint.time).order_by(OzonePoint.time)]
+
+    def test_only_unseen_points_in_overlap(self):
+        times = pd.date_range('2018-05-01 09:00', '2018-05-01 13:00', freq='15min')
+        valid = np.ones(len(times), dtype=bool)
+        valid[-1] = False
+
+        new = select_new(self.session, OZONE, self.graph, times, valid)
+        self.assertEqual(list(times[new]), list(pd.date_range('2018-05-01 12:15', '2018-05-01 12:45', freq='15min')))
+
+    def test_late_arrival_inside_overlap(self):
+        times = pd.DatetimeIndex(['2018-05-01 10:50', '2018-05-01 11:10', '2018-05-01 11:15', '2018-05-01 12:05'])
+        new = select_new(self.session, OZONE, self.graph, times, np.ones(len(times), dtype=bool))
+        # 10:50 is older than the overlap window, 11:15 is already stored
+        self.assertEqual(list(new), [False, True, False, True])
+
+    def test_insert_skips_stored_points(self):
+        self.insert(pd.date_range('2018-05-01 11:30', '2018-05-01 12:30', freq='15min'))
+        expected = list(self.stored) + list(pd.date_range('2018-05-01 12:15', '2018-05-01 12:30', freq='15min'))
+        self.assertEqual(self.stored_times(), [time.to_pydatetime() for time in expected])
+
+
+class CutoffTestCase(unittest.TestCase):
+    """
+    The DynamoDB cutoff covers the stalest populated graph of a sensor.
+    """
+
+    def test_stalest_graph_minus_overlap(self):
+        graphs = {'o3': OzoneGraph(updatets=datetime(2018, 5, 2)), 'h2s': H2SGraph(updatets=datetime(2018, 5, 1))}
+        self.assertEqual(get_cutoff(graphs), datetime2str(datetime(2018, 5, 1) - INGEST_OVERLAP))
+
+    def test_never_populated_graphs_ignored(self):
+        graphs = {'o3': OzoneGraph(updatets=datetime(2018, 5, 2)), 'h2s': H2SGraph(updatets=EPOCH)}
+        self.assertEqual(get_cutoff(graphs), datetime2str(datetime(2018, 5, 2) - INGEST_OVERLAP))
+
+    def test_new_sensor_pulls_from_epoch(self):
+        graphs = {'o3': OzoneGraph(updatets=EPOCH), 'h2s': H2SGraph(updatets=EPOCH)}
+        self.assertEqual(get_cutoff(graphs), datetime2str(EPOCH - INGEST_OVERLAP))
+        self.assertEqual(get_backfill(graphs), ([], None))
+
+
+class BackfillTestCase(unittest.TestCase):
+    """
+    Graphs left at EPOCH next to populated ones get their history pulled once, up to the refreshes' cutoff.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        add_sensors(self.Session, [1])
+
+        # Every series but temperature has been refreshed up to May 2nd
+        session = self.Session()
+        graphs = ingest.get_graphs(session.query(Sensor).get(1))
+        for key, graph in graphs.items():
+            if key != 'temperature':
+                graph.updatets = datetime(2018, 5, 2)
+        session.commit()
+        session.close()
+
+    def pull(self, timest):
+        def pull_db(sensor_id, days, cutoff, fields, end=None):
+            df = decode_items([], fields)
+            df['timest'] = np.array(timest, dtype=np.int64)
+            for field in fields[1:]:
+                df[field] = 70.0
+            return df
+        return pull_db
+
+    def test_pulls_missing_series_up_to_cutoff(self):
+        with mock.patch.object(ingest, 'pull_db', side_effect=self.pull([20180410120000, 20180501120000])) as pull_db:
+            self.assertEqual(ingest.backfill_sensors(self.Session), {1: 2})
+
+        (sensor_id, _, cutoff, fields), kwargs = pull_db.call_args
+        self.assertEqual(fields, ['timest', 'temp1', 'temp2', 'temp3'])
+        self.assertEqual(cutoff, datetime2str(EPOCH - INGEST_OVERLAP))
+        self.assertEqual(kwargs['end'], datetime2str(datetime(2018, 5, 2) - INGEST_OVERLAP))
+
+        session = self.Session()
+        self.assertEqual(session.query(TemperaturePoint).count(), 2)
+        self.assertEqual(session.query(OzonePoint).count(), 0)
+        graphs = ingest.get_graphs(session.query(Sensor).get(1))
+        self.assertEqual(graphs['temperature'].updatets, datetime(2018, 5, 1, 12))
+        self.assertEqual(get_cutoff(graphs), datetime2str(datetime(2018, 5, 1, 12) - INGEST_OVERLAP))
+        session.close()
+
+    def test_runs_once(self):
+        with mock.patch.object(ingest, 'pull_db', side_effect=self.pull([20180501120000])):
+            ingest.backfill_sensors(self.Session)
+        with mock.patch.object(ingest, 'pull_db') as pull_db:
+            self.assertEqual(ingest.backfill_sensors(self.Session), {1: 0})
+        pull_db.assert_not_called()
+
+
+class RevisionTestCase(unittest.TestCase):
+    """
+    Every insert bumps a graph's revision, late points included, so cached figures are rebuilt.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.sensor = Sensor(id=1)
+        for gas in GASES:
+            setattr(self.sensor, gas.m, 1.0)
+            setattr(self.sensor, gas.z, 0.0)
+        self.session.add(self.sensor)
+        self.graphs = get_graphs(self.sensor)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def write(self, timest, ozone):
+        df = pd.DataFrame({field: np.full(len(timest), np.nan) for field in INGEST_FIELDS})
+        df['timest'] = np.array(timest, dtype=np.int64)
+        df['O3_avg'] = ozone
+        df['O3_std'] = 1.0
+        write_points(self.session, self.sensor, self.graphs, df)
+        self.session.commit()
+
+    def test_late_points_bump_revision_only(self):
+        ozone = self.graphs['o3']
+        self.assertEqual(ozone.revision, 0)
+
+        self.write([20180501120000, 20180501121500], [1.0, 2.0])
+        self.assertEqual((ozone.updatets, ozone.revision), (datetime(2018, 5, 1, 12, 15), 1))
+
+        self.write([20180501114500], [3.0])
+        self.assertEqual((ozone.updatets, ozone.revision), (datetime(2018, 5, 1, 12, 15), 2))
+
+        # Nothing new, nothing to rebuild
+        self.write([20180501114500, 20180501121500], [3.0, 2.0])
+        self.assertEqual(ozone.revision, 2)
+        self.assertEqual(self.graphs['h2s'].revision, 0)
@@ -0,0 +1,108 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .. import ingest, layers
+from ..dynamo_pull import decode_items
+from ..ingest import INGEST_FIELDS
+from ..layers import SensorLayerCache, sensor_layer_cache
+from ..model import Base, GASES, Sensor
+
+
+class SensorLayerCacheTestCase(unittest.TestCase):
+    """
+    Cached payloads expire after the timeout.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(layers, 'time')
+        self.time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.time.monotonic.return_value = 100.0
+
+    def test_expires_after_timeout(self):
+        cache = SensorLayerCache(timeout=300)
+        cache.set(True, 'payload')
+
+        self.time.monotonic.return_value = 400.0
+        self.assertEqual(cache.get(True), 'payload')
+        self.time.monotonic.return_value = 400.5
+        self.assertIsNone(cache.get(True))
+
+    def test_invalidate_latest_keeps_locations(self):
+        cache = SensorLayerCache()
+        cache.set(True, 'latest')
+        cache.set(False, 'locations')
+        cache.invalidate_latest()
+        self.assertIsNone(cache.get(True))
+        self.assertEqual(cache.get(False), 'locations')
+
+
+class SensorLayerInvalidationTestCase(unittest.TestCase):
+    """
+    Ingests that store points drop the layer with latest readings, sensor changes drop both.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        session = self.Session()
+        sensor = Sensor(id=1, latitude=39.3, longitude=-76.6)
+        for gas in GASES:
+            setattr(sensor, gas.m, 1.0)
+            setattr(sensor, gas.z, 0.0)
+        session.add(sensor)
+        session.commit()
+        session.close()
+
+        patcher = mock.patch.object(layers, 'get_session', self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        sensor_layer_cache.clear()
+        self.addCleanup(sensor_layer_cache.clear)
+
+    def refresh(self, timest):
+        df = decode_items([], INGEST_FIELDS)
+        df['timest'] = np.array(timest, dtype=np.int64)
+        df['O3_avg'] = 30.0
+        df['O3_std'] = 1.0
+        with mock.patch.object(ingest, 'pull_db', return_value=df):
+            self.assertTrue(ingest.refresh_sensor(1, self.Session))
+
+    def test_served_from_cache(self):
+        with mock.patch.object(layers, 'build_sensor_layer', wraps=layers.build_sensor_layer) as build:
+            layers.get_sensor_layer(True)
+            features, center = layers.get_sensor_layer(True)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(center, [-76.6, 39.3])
+
+    def test_ingest_drops_latest_readings(self):
+        self.assertEqual(layers.get_sensor_layer(True)[0]['features'][0]['properties']['latest'], {})
+        layers.get_sensor_layer(False)
+
+        self.refresh([20180501120000])
+        self.assertIsNone(sensor_layer_cache.get(True))
+        self.assertIsNotNone(sensor_layer_cache.get(False))
+        latest = layers.get_sensor_layer(True)[0]['features'][0]['properties']['latest']
+        self.assertEqual(latest['o3'], 30.0)
+
+        # Nothing new stored, nothing rebuilt
+        self.refresh([20180501120000])
+        self.assertIsNotNone(sensor_layer_cache.get(True))
+
+    def test_sensor_changes_drop_both(self):
+        layers.get_sensor_layer(True)
+        layers.get_sensor_layer(False)
+
+        session = self.Session()
+        session.query(Sensor).get(1).latitude = 39.4
+        session.commit()
+        session.close()
+
+        self.assertIsNone(sensor_layer_cache.get(True))
+        self.assertIsNone(sensor_layer_cache.get(False))
+        self.assertEqual(layers.get_sensor_layer(False)[1], [-76.6, 39.4])
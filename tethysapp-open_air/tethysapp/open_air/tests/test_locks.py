@@ -0,0 +1,169 @@
+import threading
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from .. import ingest
+from ..dynamo_pull import decode_items
+from ..locks import LOCK_NOT_AVAILABLE, AdvisoryLocks, SingleFlight, wait_advisory_lock
+from ..model import Base, GASES, Sensor
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    """
+    One leader per key, followers wait for it (or not) and never do the work.
+    """
+
+    def test_claim_and_release(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.claim(1), (True, None))
+        leader, event = flights.claim(1)
+        self.assertFalse(leader)
+        self.assertFalse(event.is_set())
+        self.assertTrue(flights.claim(2)[0])
+
+        flights.release(1)
+        self.assertTrue(event.is_set())
+        self.assertFalse(flights.in_flight(1))
+        self.assertTrue(flights.claim(1)[0])
+
+    def test_followers_wait_for_the_leader(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        finish = threading.Event()
+        runs = []
+        order = []
+
+        def leader():
+            with flights.flight('sensor') as is_leader:
+                runs.append(is_leader)
+                started.set()
+                finish.wait(5)
+                order.append('leader done')
+
+        def follower():
+            with flights.flight('sensor', timeout=5) as is_leader:
+                runs.append(is_leader)
+                order.append('follower done')
+
+        threads = [threading.Thread(target=leader)]
+        threads[0].start()
+        started.wait(5)
+        threads += [threading.Thread(target=follower) for _ in range(4)]
+        for thread in threads[1:]:
+            thread.start()
+        finish.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(sorted(runs), [False] * 4 + [True])
+        self.assertEqual(order[0], 'leader done')
+        self.assertFalse(flights.in_flight('sensor'))
+
+    def test_follower_without_wait_returns_at_once(self):
+        flights = SingleFlight()
+        flights.claim('sensor')
+        with flights.flight('sensor', wait=False, timeout=5) as is_leader:
+            self.assertFalse(is_leader)
+        self.assertTrue(flights.in_flight('sensor'))
+
+    def test_leader_released_on_error(self):
+        flights = SingleFlight()
+        with self.assertRaises(RuntimeError):
+            with flights.flight('sensor'):
+                raise RuntimeError()
+        self.assertFalse(flights.in_flight('sensor'))
+
+
+class PostgresError(Exception):
+
+    def __init__(self, pgcode):
+        self.pgcode = pgcode
+
+
+def postgres_session(*results):
+    session = mock.Mock()
+    session.get_bind.return_value.dialect.name = 'postgresql'
+    session.execute.side_effect = results
+    return session
+
+
+class AdvisoryLockTestCase(unittest.TestCase):
+    """
+    Advisory lock helpers against a mocked PostgreSQL session and engine.
+    """
+
+    def test_wait_times_out(self):
+        session = postgres_session(None, OperationalError('SELECT', {}, PostgresError(LOCK_NOT_AVAILABLE)))
+        self.assertFalse(wait_advisory_lock(session, 14, timeout=1))
+        session.rollback.assert_called_once_with()
+
+    def test_wait_other_errors_raise(self):
+        session = postgres_session(None, OperationalError('SELECT', {}, PostgresError('08006')))
+        with self.assertRaises(OperationalError):
+            wait_advisory_lock(session, 14, timeout=1)
+
+    def test_wait_acquired(self):
+        self.assertTrue(wait_advisory_lock(postgres_session(None, None), 14, timeout=1))
+
+    def test_session_level_locks_released_on_close(self):
+        engine = mock.Mock()
+        engine.dialect.name = 'postgresql'
+        connection = engine.connect.return_value.execution_options.return_value
+        connection.execute.return_value.scalar.side_effect = [True, False, True]
+
+        locks = AdvisoryLocks(engine)
+        self.assertEqual([locks.try_lock(sensor_id) for sensor_id in (1, 2, 3)], [True, False, True])
+        locks.unlock(1)
+        locks.unlock(2)
+        self.assertEqual(locks.held, {3})
+
+        locks.close()
+        self.assertEqual(locks.held, set())
+        self.assertEqual([call[0][0].text.split('(')[0] for call in connection.execute.call_args_list],
+                         ['SELECT pg_try_advisory_lock'] * 3 + ['SELECT pg_advisory_unlock'] * 2)
+        connection.close.assert_called_once_with()
+
+    def test_every_lock_granted_outside_postgres(self):
+        locks = AdvisoryLocks(create_engine('sqlite://'))
+        self.assertTrue(locks.try_lock(1))
+        locks.unlock(1)
+        locks.close()
+
+    def test_refresh_serves_stored_data_on_wait_timeout(self):
+        Session = sessionmaker(bind=create_engine('sqlite://'))
+        with mock.patch.object(ingest, 'try_advisory_lock', return_value=False), \
+                mock.patch.object(ingest, 'wait_advisory_lock', return_value=False) as wait, \
+                mock.patch.object(ingest, 'pull_db') as pull:
+            self.assertTrue(ingest.update_sensor(14, Session))
+        wait.assert_called_once()
+        pull.assert_not_called()
+
+    def test_fleet_refresh_only_pulls_locked_sensors(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        session = Session()
+        for sensor_id in (1, 2):
+            sensor = Sensor(id=sensor_id)
+            for gas in GASES:
+                setattr(sensor, gas.m, 1.0)
+                setattr(sensor, gas.z, 0.0)
+            session.add(sensor)
+        session.commit()
+        session.close()
+
+        locks = mock.Mock()
+        locks.try_lock.side_effect = lambda sensor_id: sensor_id == 1
+        empty = decode_items([], ingest.INGEST_FIELDS)
+        with mock.patch.object(ingest, 'AdvisoryLocks', return_value=locks), \
+                mock.patch.object(ingest, 'pull_db', return_value=empty) as pull:
+            results = ingest.update_all_sensors(Session, max_workers=2)
+
+        self.assertEqual([call[0][0] for call in pull.call_args_list], [1])
+        self.assertTrue(all(result.success for result in results.values()))
+        locks.unlock.assert_called_once_with(1)
+        locks.close.assert_called_once_with()
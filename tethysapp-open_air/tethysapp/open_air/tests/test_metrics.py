@@ -0,0 +1,55 @@
+import unittest
+
+from ..metrics import Metrics, PREFIX
+
+
+class MetricsTestCase(unittest.TestCase):
+    """
+    Counters and span histograms rendered in the Prometheus text format.
+    """
+
+    def setUp(self):
+        self.metrics = Metrics(buckets=(0.01, 0.1, 1))
+
+    def test_counters(self):
+        self.metrics.incr('rows_pulled', 3)
+        self.metrics.incr('rows_pulled', 2)
+        self.metrics.incr('graph_cache', result='hit')
+        self.metrics.incr('graph_cache', result='miss')
+        self.metrics.incr('graph_cache', result='hit')
+
+        lines = self.metrics.render().splitlines()
+        self.assertEqual(lines, [
+            '# TYPE {0}graph_cache_total counter'.format(PREFIX),
+            '{0}graph_cache_total{{result="hit"}} 2'.format(PREFIX),
+            '{0}graph_cache_total{{result="miss"}} 1'.format(PREFIX),
+            '# TYPE {0}rows_pulled_total counter'.format(PREFIX),
+            '{0}rows_pulled_total 5'.format(PREFIX),
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        for seconds in (0.005, 0.05, 0.05, 5):
+            self.metrics.observe('ingest_write', seconds, sensor='14')
+
+        lines = self.metrics.render().splitlines()
+        metric = PREFIX + 'ingest_write_seconds'
+        self.assertEqual(lines[0], '# TYPE {0} histogram'.format(metric))
+        self.assertEqual(lines[1:5], [
+            '{0}_bucket{{sensor="14",le="0.01"}} 1'.format(metric),
+            '{0}_bucket{{sensor="14",le="0.1"}} 3'.format(metric),
+            '{0}_bucket{{sensor="14",le="1"}} 3'.format(metric),
+            '{0}_bucket{{sensor="14",le="+Inf"}} 4'.format(metric),
+        ])
+        self.assertTrue(lines[5].startswith('{0}_sum{{sensor="14"}} 5.105'.format(metric)))
+        self.assertEqual(lines[6], '{0}_count{{sensor="14"}} 4'.format(metric))
+
+    def test_span_records_errors_and_escapes_labels(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.span('render', view='say "hi"'):
+                raise ValueError()
+        self.assertIn('{0}render_seconds_count{{view="say \\"hi\\""}} 1'.format(PREFIX), self.metrics.render())
+
+    def test_reset(self):
+        self.metrics.incr('rows_pulled')
+        self.metrics.reset()
+        self.assertEqual(self.metrics.render(), '\n')
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .. import ingest, model
+from ..model import Sensor, init_sensor_db
+
+LOCATIONS = '''"meta:instanceID","id","Location:Latitude","Location:Longitude"
+"a","14","39.25","-76.64"
+"b","46","39.26","-76.65"
+"c","46","0","0"
+"d","99","39.27","-76.66"
+"e","100","",""
+'''
+
+# Sensor 14 has O3 and NO2 coefficients, 46 only O3, 99 none; H2S and SO2 are missing altogether
+COEFFICIENTS = ''',O3_avg,O3_avg,NO2_avg,NO2_avg
+,zero,m,zero,m
+id,,,,
+14,1773.5,2.1,228.8,-0.07
+46,1693.8,3.2,,
+'''
+
+
+class InitSensorDbTestCase(unittest.TestCase):
+    """
+    The bulk bootstrap stores one row per located sensor, reading raw values for gases without coefficients.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, text in (('locations.csv', LOCATIONS), ('zeroes.csv', COEFFICIENTS)):
+            with open(os.path.join(self.directory, name), 'w') as f:
+                f.write(text)
+        for name, path in (('loc_file', 'locations.csv'), ('cal_file', 'zeroes.csv')):
+            patcher = mock.patch.object(model, name, os.path.join(self.directory, path))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_partial_coefficients(self):
+        engine = create_engine('sqlite://')
+        with mock.patch.object(ingest, 'update_all_sensors') as update_all_sensors:
+            init_sensor_db(engine, True)
+        update_all_sensors.assert_called_once()
+
+        session = sessionmaker(bind=engine)()
+        sensors = dict((sensor.id, sensor) for sensor in session.query(Sensor))
+        session.close()
+
+        # Duplicates keep their first location, sensors without one are left out
+        self.assertEqual(sorted(sensors), [14, 46, 99])
+        self.assertEqual((sensors[46].latitude, sensors[46].longitude), (39.26, -76.65))
+
+        def coefficients(sensor):
+            return [getattr(sensor, name) for name in ('m_o3', 'z_o3', 'm_no2', 'z_no2', 'm_h2s', 'z_h2s',
+                                                       'm_so2', 'z_so2')]
+
+        self.assertEqual(coefficients(sensors[14]), [2.1, 1773.5, -0.07, 228.8, 1.0, 0.0, 1.0, 0.0])
+        self.assertEqual(coefficients(sensors[46]), [3.2, 1693.8, 1.0, 0.0, 1.0, 0.0, 1.0, 0.0])
+        self.assertEqual(coefficients(sensors[99]), [1.0, 0.0] * 4)
@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, func, text
+from sqlalchemy.orm import sessionmaker
+
+from ..ingest import insert_points
+from ..model import Base, GASES, DailyRollup, HourlyRollup, OzoneGraph, OzonePoint, Sensor, migrate_sensor_db
+from ..partitions import archive_partitions, ensure_partitions, next_month, partition_name, previous_month
+from ..rollups import rebuild_rollups
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+OZONE = next(gas for gas in GASES if gas.key == 'o3')
+
+
+class MonthTestCase(unittest.TestCase):
+
+    def test_months(self):
+        self.assertEqual(next_month(datetime(2018, 12, 1)), datetime(2019, 1, 1))
+        self.assertEqual(next_month(datetime(2018, 5, 1)), datetime(2018, 6, 1))
+        self.assertEqual(previous_month(datetime(2018, 1, 1)), datetime(2017, 12, 1))
+        self.assertEqual(previous_month(datetime(2018, 5, 1)), datetime(2018, 4, 1))
+        self.assertEqual(partition_name('ozone_points', datetime(2018, 5, 1)), 'ozone_points_p201805')
+
+
+class EnsurePartitionsTestCase(unittest.TestCase):
+    """
+    Current and next month's partitions are created ahead of ingest, each in its own transaction.
+    """
+
+    def postgres_engine(self, partitioned, existing):
+        engine = mock.MagicMock()
+        engine.dialect.name = 'postgresql'
+
+        def execute(statement, params=None):
+            result = mock.MagicMock()
+            if 'pg_class' in str(statement):
+                result.__iter__.return_value = iter([(name,) for name in partitioned])
+            else:
+                result.scalar.return_value = params['name'] if params['name'] in existing else None
+            return result
+
+        engine.execute.side_effect = execute
+        self.connection = engine.begin.return_value.__enter__.return_value
+        return engine
+
+    def created(self):
+        return [str(call[0][0]).split()[5] for call in self.connection.execute.call_args_list
+                if 'PARTITION OF' in str(call[0][0])]
+
+    def test_creates_missing_current_and_next_month(self):
+        engine = self.postgres_engine(['ozone_points', 'no2_points'], ['ozone_points_p201812'])
+        ensure_partitions(engine, now=datetime(2018, 12, 20))
+        self.assertEqual(self.created(), ['ozone_points_p201901', 'no2_points_p201812', 'no2_points_p201901'])
+
+    def test_nothing_outside_postgres(self):
+        ensure_partitions(create_engine('sqlite://'))
+
+
+@unittest.skipIf(pq is None, 'pyarrow is not installed')
+class ArchiveTestCase(unittest.TestCase):
+    """
+    Months older than the hot retention period move to Parquet and out of the database.
+    """
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        session = sessionmaker(bind=self.engine)()
+        session.add(Sensor(id=1))
+        session.add(OzoneGraph(id=1, sensor_id=1, updatets=datetime(2018, 5, 31)))
+        times = pd.date_range('2018-01-01', '2018-05-31', freq='6h')
+        insert_points(session, OzonePoint.__table__, OZONE.foreign_key, 1, times,
+                      ppb=np.arange(len(times), dtype=np.float64), std=np.ones(len(times)))
+        session.commit()
+        session.close()
+
+    def test_archive_cold_months(self):
+        paths = archive_partitions(self.engine, self.directory, retention_months=2)
+        self.assertEqual([os.path.basename(path) for path in paths],
+                         ['ozone_points_201801.parquet', 'ozone_points_201802.parquet'])
+
+        table = pq.read_table(paths[0])
+        self.assertEqual(table.num_rows, 31 * 4)
+        self.assertEqual(table.column_names, [column.name for column in OzonePoint.__table__.columns])
+
+        oldest = self.engine.execute(OzonePoint.__table__.select().order_by(OzonePoint.time).limit(1)).fetchone()
+        self.assertEqual(oldest.time, datetime(2018, 3, 1))
+        self.assertEqual(archive_partitions(self.engine, self.directory, retention_months=2), [])
+
+    def rollup_counts(self, model):
+        session = sessionmaker(bind=self.engine)()
+        try:
+            return dict(session.query(func.strftime('%m', model.time), func.sum(model.count))
+                               .group_by(func.strftime('%m', model.time)).all())
+        finally:
+            session.close()
+
+    def test_rollups_outlive_archive_and_migration(self):
+        session = sessionmaker(bind=self.engine)()
+        rebuild_rollups(session)
+        session.commit()
+        session.close()
+        hourly, daily = self.rollup_counts(HourlyRollup), self.rollup_counts(DailyRollup)
+        self.assertEqual(daily['01'], 31 * 4)
+
+        archive_partitions(self.engine, self.directory, retention_months=2)
+
+        # A database from before the unique index, holding a duplicate point, makes the migration
+        # deduplicate and rebuild the rollups
+        self.engine.execute(text('DROP INDEX uq_ozone_points_graph_time'))
+        self.engine.execute(OzonePoint.__table__.insert(),
+                            {'ozone_graph_id': 1, 'time': datetime(2018, 5, 1), 'ppb': 1.0, 'std': 1.0})
+        migrate_sensor_db(self.engine)
+
+        self.assertEqual(self.rollup_counts(HourlyRollup), hourly)
+        self.assertEqual(self.rollup_counts(DailyRollup), daily)
+
+    def test_retention_disabled(self):
+        self.assertEqual(archive_partitions(self.engine, self.directory, retention_months=0), [])
@@ -0,0 +1,89 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ..ingest import insert_points
+from ..model import Base, GASES, DailyRollup, HourlyRollup, OzoneGraph, OzonePoint, Sensor
+from ..rollups import ROLLUP_COLUMNS, aggregate, day_ranges, update_rollups
+
+OZONE = next(gas for gas in GASES if gas.key == 'o3')
+
+
+class RollupTestCase(unittest.TestCase):
+    """
+    Rollups updated batch by batch must match an aggregation of every stored raw point at once.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add(Sensor(id=1))
+        self.session.add(OzoneGraph(id=1, sensor_id=1))
+        self.session.flush()
+        self.rng = np.random.RandomState(0)
+
+    def tearDown(self):
+        self.session.close()
+
+    def feed(self, times):
+        """
+        Store points (skipping any already stored, like ingest) and update the rollups with every time fed.
+        """
+        times = pd.DatetimeIndex(times)
+        values = self.rng.normal(50, 10, len(times))
+        insert_points(self.session, OzonePoint.__table__, OZONE.foreign_key, 1, times, ppb=values, std=values)
+        update_rollups(self.session, OZONE, 1, 1, times)
+
+    def assertMatchesRaw(self, model, freq):
+        raw = self.session.query(OzonePoint.time, OzonePoint.ppb).all()
+        expected = aggregate([row[0] for row in raw], [row[1] for row in raw], freq).set_index('time')
+        rows = self.session.query(model.time, model.count, model.mean, model.std, model.min, model.max) \
+                           .filter(model.sensor_id == 1, model.gas == 'o3').order_by(model.time).all()
+        stored = pd.DataFrame(rows, columns=ROLLUP_COLUMNS)
+        stored = stored.set_index(pd.DatetimeIndex(stored['time'])).drop(columns='time')
+
+        self.assertEqual(list(stored.index), list(expected.index))
+        np.testing.assert_allclose(stored.to_numpy(dtype=np.float64), expected.to_numpy(dtype=np.float64))
+
+    def test_day_ranges(self):
+        times = pd.DatetimeIndex(['2018-05-03 10:00', '2018-05-01 23:45', '2018-05-02 00:00', '2018-05-02 08:00'])
+        self.assertEqual([(str(start), str(end)) for start, end in day_ranges(times)], [
+            ('2018-05-01 00:00:00', '2018-05-04 00:00:00'),
+        ])
+        self.assertEqual(len(day_ranges(pd.DatetimeIndex(['2018-05-01', '2018-05-03']))), 2)
+
+    def test_backfill_into_gap(self):
+        self.feed(pd.date_range('2018-05-01 09:00', '2018-05-01 10:45', freq='15min'))
+        self.feed(pd.date_range('2018-05-01 14:00', '2018-05-01 15:45', freq='15min'))
+        self.feed(pd.date_range('2018-05-01 12:00', '2018-05-01 12:45', freq='15min'))
+
+        self.assertMatchesRaw(HourlyRollup, '60min')
+        self.assertMatchesRaw(DailyRollup, '1D')
+
+    def test_late_point_across_untouched_buckets(self):
+        self.feed(pd.date_range('2018-05-01 09:00', '2018-05-01 11:45', freq='15min'))
+        self.feed(pd.date_range('2018-05-03 09:00', '2018-05-03 11:45', freq='15min'))
+
+        # A late 10:50 point arrives together with the next readings, the 11:00 hour
+        # and the whole of May 3rd lie between them without being touched
+        self.feed(pd.DatetimeIndex(['2018-05-01 10:50']).append(
+            pd.date_range('2018-05-04 12:00', '2018-05-04 13:45', freq='15min')))
+
+        self.assertMatchesRaw(HourlyRollup, '60min')
+        self.assertMatchesRaw(DailyRollup, '1D')
+
+    def test_points_stored_by_a_concurrent_refresh_count_once(self):
+        self.feed(pd.date_range('2018-05-01 09:00', '2018-05-01 10:45', freq='15min'))
+
+        # A second refresh that missed the lock re-sends the same points plus new ones,
+        # its INSERT skips the stored ones but they still reach the rollups
+        self.feed(pd.date_range('2018-05-01 09:00', '2018-05-01 11:45', freq='15min'))
+
+        self.assertMatchesRaw(HourlyRollup, '60min')
+        self.assertMatchesRaw(DailyRollup, '1D')
+        counts = [row[0] for row in self.session.query(HourlyRollup.count).order_by(HourlyRollup.time)]
+        self.assertEqual(counts, [4, 4, 4])
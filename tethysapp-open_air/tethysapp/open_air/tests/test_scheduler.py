@@ -0,0 +1,85 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from .. import ingest, scheduler
+from ..dynamo_pull import decode_items
+from ..model import Base, GASES, Sensor, SensorRefresh
+from ..scheduler import RefreshScheduler
+
+
+class SchedulerTestCase(unittest.TestCase):
+    """
+    Staleness is judged from refresh times in the database, shared by every process.
+    """
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.Session = sessionmaker(bind=engine)
+        session = self.Session()
+        for sensor_id in (1, 2):
+            sensor = Sensor(id=sensor_id)
+            for gas in GASES:
+                setattr(sensor, gas.m, 1.0)
+                setattr(sensor, gas.z, 0.0)
+            session.add(sensor)
+        session.commit()
+        session.close()
+
+        patcher = mock.patch.object(ingest, 'pull_db', side_effect=lambda sensor_id, days, cutoff, fields:
+                                    decode_items([], fields))
+        self.pull = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def refreshed(self, sensor_id, minutes_ago):
+        session = self.Session()
+        session.merge(SensorRefresh(sensor_id=sensor_id, time=datetime.now() - timedelta(minutes=minutes_ago)))
+        session.commit()
+        session.close()
+
+    def pulled(self):
+        return sorted(call[0][0] for call in self.pull.call_args_list)
+
+    def test_refresh_seen_by_other_processes(self):
+        RefreshScheduler(Session=self.Session).run_once()
+        self.assertEqual(self.pulled(), [1, 2])
+
+        # A scheduler in another worker process starts with nothing in memory
+        other = RefreshScheduler(Session=self.Session)
+        self.assertEqual(other.run_once(), {})
+        self.assertFalse(other.is_stale(1))
+        self.assertEqual(self.pulled(), [1, 2])
+
+    def test_only_stale_sensors_refreshed(self):
+        self.refreshed(1, 20)
+        self.refreshed(2, 5)
+        results = RefreshScheduler(staleness=15, Session=self.Session).run_once()
+        self.assertEqual(sorted(results), [1])
+
+        # Per-sensor budgets override the default
+        self.refreshed(1, 5)
+        results = RefreshScheduler(staleness=15, budgets={2: timedelta(minutes=1)}, Session=self.Session).run_once()
+        self.assertEqual(sorted(results), [2])
+
+    def test_single_refresh_recorded_for_everyone(self):
+        self.assertTrue(ingest.update_sensor(1, self.Session))
+        self.assertFalse(RefreshScheduler(Session=self.Session).is_stale(1))
+        self.assertTrue(RefreshScheduler(Session=self.Session).refresh_if_stale(1, timedelta(minutes=10)))
+        self.assertEqual(self.pulled(), [1])
+
+    def test_pass_skipped_without_the_leader_lock(self):
+        leader = mock.Mock()
+        leader.try_lock.return_value = False
+        refresh = RefreshScheduler(Session=self.Session)
+        with mock.patch.object(scheduler, 'AdvisoryLocks', return_value=leader):
+            self.assertFalse(refresh.run_pass())
+        self.assertEqual(self.pulled(), [])
+        leader.close.assert_called_once_with()
+
+    def test_pass_as_leader(self):
+        self.assertTrue(RefreshScheduler(Session=self.Session).run_pass())
+        self.assertEqual(self.pulled(), [1, 2])